@@ -1,21 +1,33 @@
 import json
+import os
 import re
 import time
 from pathlib import Path
 from time import sleep
-from typing import Set
+from typing import List
 from urllib.parse import quote
 
 import requests
+from requests.adapters import HTTPAdapter
 from PyQt5.QtCore import QObject
-from bs4 import BeautifulSoup
 from selenium.common import TimeoutException
 
 from constant import *
+from context_health import ContextHealth
 from cookies import CookieManager
 from crypto import get_encrypt_by_str, base64_encode
+from dxm_client import DxmClient
 from extractor import AmazonASINExtractor
+from http_fetch import (AMAZON_HTTP_HEADERS, CAPTCHA_MARKERS, FETCH_MODE_BROWSER, FETCH_MODE_TIERED,
+                        NOT_FOUND_MARKERS, PAGE_CAPTCHA, PAGE_NOT_FOUND, PAGE_OK, PAGE_TIMEOUT, PAGE_UNKNOWN,
+                        http_fetch_product)
+from pacing import AdaptivePacer
+from page_parser import extract_price, parse_product_html
+from resource_policy import ResourceBlocker, ResourcePolicy
+from launch_config import BrowserLaunchConfig
 from logger import setup_concurrent_logging
+from asin_cache import AsinResultCache
+from memory_watchdog import MemoryWatchdog, playwright_driver_pid
 from bean import Product
 import concurrent.futures
 from util import curr_milliseconds, ensure_dir_exists
@@ -29,19 +41,186 @@ extractor = AmazonASINExtractor()
 logger = setup_concurrent_logging()
 
 
-def shipping_from_amazon(ships_from, sold_by):
-    return 'amazon' in ships_from.lower() or 'amazon' in sold_by.lower()
+def settle_page_state(product: Product, state: str) -> bool:
+    """
+    根据页面状态标记 404 或验证码页面。
+
+    :return: True 表示 product 已处理完毕，无需再兜底获取页面
+    """
+    url = product.url
+    if state == PAGE_NOT_FOUND:
+        print(f'{url} 链接失效，疑似 404 页面。')
+        logger.warning(f'{url} 链接失效，疑似 404 页面。')
+        product.completed = True
+        product.invalid = True
+        return True
+
+    if state == PAGE_CAPTCHA:
+        print(f'{url} 遇到亚马逊验证码/机器人检查页面。')
+        logger.warning(f'{url} 遇到亚马逊验证码/机器人检查页面。')
+        product.completed = False  # 标记为未完成，以便重试
+        product.last_error = PAGE_CAPTCHA
+        return True
+    return False
+
+
+def fetch_with_session(session: requests.Session, product: Product, pacer: AdaptivePacer = None):
+    """
+    使用 requests 兜底获取页面源码。
+
+    :return: 页面源码；返回 None 时 product 已被标记 (失效或待重试)
+    """
+    url = product.url
+    try:
+        resp = session.get(url, timeout=10)
+        if resp.status_code == 503:
+            # 503 是限流而不是链接失效，降速后重试
+            print(f'{url} 请求被限流，状态码：503')
+            logger.warning(f'{url} 请求被限流，状态码：503')
+            if pacer is not None:
+                pacer.on_throttle()
+            product.completed = False
+            product.last_error = 'http_503'
+            return None
+        if resp.status_code == 404:
+            product.completed = True
+            product.invalid = True
+            return None
+        elif resp.status_code != 200:
+            print(f'{url} 链接失效，状态码：{resp.status_code}')
+            product.completed = True
+            product.invalid = True
+            return None
+        return resp.text
+    except Exception as req_err:
+        print(f'{url} Requests 兜底也失败：{req_err}')
+        product.completed = False
+        product.last_error = 'request_error'
+        return None
+
+
+# 站点域名
+MARKETPLACE = 'www.amazon.com'
+# 设置好邮编的会话状态 (Cookies + localStorage) 缓存，按站点和邮编区分
+STORAGE_STATE_DIR = Path(CACHE_DIR) / 'storage_state'
+# 缓存的会话状态最长复用时间 (秒)
+STORAGE_STATE_MAX_AGE = 7 * 24 * 60 * 60
+_GLOW_ADDRESS_RE = re.compile(r'id=["\']glow-ingress-line2["\'][^>]*>([^<]*)<')
+
+
+def storage_state_path(marketplace: str = MARKETPLACE, zip_code: str = ZIP_CODE) -> Path:
+    return STORAGE_STATE_DIR / f'{marketplace}_{zip_code}.json'
+
+
+def load_storage_state(marketplace: str = MARKETPLACE, zip_code: str = ZIP_CODE):
+    """读取缓存的会话状态，不存在、过期或关键 Cookie 已失效时返回 None"""
+    path = storage_state_path(marketplace, zip_code)
+    try:
+        if time.time() - path.stat().st_mtime > STORAGE_STATE_MAX_AGE:
+            return None
+        state = json.loads(path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+    now = time.time()
+    for cookie in state.get('cookies', []):
+        if cookie.get('name') == 'session-id':
+            expires = cookie.get('expires', -1)
+            return state if expires == -1 or expires > now else None
+    return None
+
+
+def save_storage_state(state: dict, marketplace: str = MARKETPLACE, zip_code: str = ZIP_CODE):
+    """写入会话状态缓存，先写临时文件再替换，避免多个 agent 同时写入时读到半个文件"""
+    path = storage_state_path(marketplace, zip_code)
+    try:
+        ensure_dir_exists(path.parent)
+        tmp_path = path.with_suffix(f'.{os.getpid()}.{curr_milliseconds()}.tmp')
+        tmp_path.write_text(json.dumps(state), encoding='utf-8')
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"保存会话状态缓存失败：{e}")
+
+
+def sync_cookies(session: requests.Session, cookies: list):
+    """把浏览器 Cookies 同步到 requests session"""
+    for cookie in cookies:
+        session.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'], path=cookie['path'])
+
+
+def zip_code_applied(session: requests.Session, zip_code: str = ZIP_CODE) -> bool:
+    """用一次 HTTP 请求确认会话的配送地址已经是指定邮编，用于校验缓存的会话状态"""
+    try:
+        resp = session.get(ZIP_INIT_URL, timeout=10)
+    except Exception as e:
+        logger.debug(f"校验会话状态失败：{e}")
+        return False
+    if resp.status_code != 200:
+        return False
+    match = _GLOW_ADDRESS_RE.search(resp.text)
+    return bool(match) and zip_code in match.group(1)
+
+
+def new_zip_session(zip_code: str = ZIP_CODE):
+    """
+    用缓存的会话状态 (浏览器设置好邮编后保存) 构建 requests 会话，供不经过浏览器的接口请求使用；
+    没有缓存或邮编未生效时返回 None
+    """
+    state = load_storage_state(zip_code=zip_code)
+    if state is None:
+        return None
+    session = requests.Session()
+    session.headers.update(AMAZON_HTTP_HEADERS)
+    sync_cookies(session, state.get('cookies', []))
+    return session if zip_code_applied(session, zip_code) else None
+
+
+CONTEXT_OPTIONS = {
+    'viewport': {"width": 1920, "height": 1080},
+    'user_agent': "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/142.0.0.0 Safari/537.36",
+    'locale': "en-US",
+    'timezone_id': "America/New_York",
+}
+STEALTH_SCRIPT = """
+                    Object.defineProperty(navigator, 'webdriver', {
+                        get: () => undefined
+                    });
+                    window.navigator.chrome = { runtime: {}, loadTimes: function() {}, csi: function() {} };
+                """
+# 用于设置邮编的商品页
+ZIP_INIT_URL = "https://www.amazon.com/dp/B0F2DTDDFV?language=en_US"
 
 # 关键元素定位器列表，用于判断页面是否成功加载
 KEY_SUCCESS_SELECTORS = [
     "span.a-price > span.a-offscreen", # 价格
-    "productTitle", # 标题
-    "dp", # 主体容器
+    "#productTitle", # 标题
+    "#dp", # 主体容器
 ]
 
+# 页面状态判定脚本：一次等待同时识别成功、验证码和 404 页面。
+# 未能判定时返回 null 继续轮询；页面已完全加载但没有任何标记时返回 unknown。
+# 文档解析完成 (readyState 不是 loading) 前不判定成功，否则 #dp 等容器出现时取到的 HTML 还不完整。
+PAGE_STATE_SCRIPT = """
+() => {
+    if (document.querySelector('form[action*="validateCaptcha"]')) return %s;
+    if (!document.documentElement || document.readyState === 'loading') return null;
+    if (document.querySelector(%s)) return %s;
+    const html = document.documentElement.innerHTML;
+    if (%s.some(marker => html.includes(marker))) return %s;
+    if (%s.some(marker => html.includes(marker))) return %s;
+    return document.readyState === 'complete' ? %s : null;
+}
+""" % (json.dumps(PAGE_CAPTCHA), json.dumps(', '.join(KEY_SUCCESS_SELECTORS)), json.dumps(PAGE_OK),
+       json.dumps(list(CAPTCHA_MARKERS)), json.dumps(PAGE_CAPTCHA),
+       json.dumps(list(NOT_FOUND_MARKERS)), json.dumps(PAGE_NOT_FOUND), json.dumps(PAGE_UNKNOWN))
+# 等待页面状态的总时限 (毫秒)
+PAGE_STATE_TIMEOUT = 15000
+
 class Agent(QObject):
 
-    def __init__(self, cache_dir: str = CACHE_DIR):
+    def __init__(self, cache_dir: str = CACHE_DIR, listing_concurrency: int = LISTING_CONCURRENCY):
+        """
+        :param listing_concurrency: 同步商品列表时同时请求的页数
+        """
         super().__init__()
         self.cache_dir = Path(cache_dir)
         self.cookie_dir = self.cache_dir / 'cookies'
@@ -66,7 +245,13 @@ class Agent(QObject):
             'Sec-Fetch-Site': 'same-origin',
             'Priority': 'u=1, i'
         }
+        self.listing_concurrency = max(1, listing_concurrency)
         self.shopping_sys_session = requests.Session()
+        # 连接池大小与并发页数一致，避免并发请求因连接池已满而重复建立连接
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.listing_concurrency)
+        self.shopping_sys_session.mount('https://', adapter)
+        # 店小秘接口的请求都经由带超时和并发限制的客户端发出，Cookies 与 shopping_sys_session 共用
+        self.dxm_client = DxmClient(self.shopping_sys_session, concurrency=self.listing_concurrency)
         self.online = False
         self.username = None
 
@@ -86,7 +271,7 @@ class Agent(QObject):
     def get_captcha(self):
         ts = curr_milliseconds()
         verify_code_url = f'{ROOT}/{VERIFY_PAGE}?t={ts}'
-        response = self.shopping_sys_session.get(verify_code_url)
+        response = self.dxm_client.get(verify_code_url)
         image = response.content
         return image
 
@@ -95,7 +280,7 @@ class Agent(QObject):
         valid = self.cookie_manager.load_cookies_json(self.shopping_sys_session, username)
         if valid:
             product_page = f'{ROOT}/{PRODUCT_PAGE}'
-            resp = self.shopping_sys_session.post(product_page, headers=self.headers)
+            resp = self.dxm_client.post(product_page, headers=self.headers)
             data = json.loads(resp.text)
             self.online = data['msg'] == 'Successful'
             if self.online:
@@ -129,7 +314,7 @@ class Agent(QObject):
             "url": ""
         }
         login_url = f'{ROOT}/{LOGIN_PAGE}'
-        resp = self.shopping_sys_session.post(login_url, data=payload, headers=self.headers)
+        resp = self.dxm_client.post(login_url, data=payload, headers=self.headers)
         data = json.loads(resp.text)
         self.cookie_manager.save_cookies_json(self.shopping_sys_session, account=username)
         self.online = 'error' not in data
@@ -139,138 +324,252 @@ class Agent(QObject):
         return self.online
 
     def post(self, url, payload):
-        resp = self.shopping_sys_session.post(url, data=payload, headers=self.headers)
+        """请求超时 (连接 5 秒、读取 30 秒) 时抛出异常，不会一直卡住工作线程"""
+        resp = self.dxm_client.post(url, data=payload, headers=self.headers)
         return resp.text
 
 
-    def parse_product_list(self, ids: Set[int]):
-        if not self.online:
-            print(f'当前用户{self.username}未登录')
-            return [], [], 0
+    def fetch_listing_page(self, page_no: int):
+        """
+        获取店小秘商品列表的一页，接口报错或请求失败时按指数退避重试。
 
+        :return: (page_no, 商品列表, 页信息)；重试后仍失败时商品列表为 None
+        """
         page_url = f'{ROOT}/{PRODUCT_PAGE}'
-        payload = {
-            'pageNo': 1,
-            'pageSize': 100,
-            'total': 0,
-            'searchType': 0,
-            'searchValue': None,
-            'shopId': -1,
-            'dxmState': 'online',
-            'dxmOfflineState': None,
-            'productStatusType': 'onSelling',
-            'sortValue': 2,
-            'sortName': 13,
-        }
-
-        # 先获取第一页，得到总页数信息
-        response = self.post(page_url, payload)
-        pages = json.loads(response)
-        page = pages['data']['page']
-        total_pages = page['totalPage']
-        total_items = page['totalSize']
-
-        # 准备多线程获取所有页面的数据
-        def fetch_page(page_no: int):
-            """获取单页数据的函数"""
+        page_payload = dict(LISTING_PAYLOAD, pageNo=page_no)
+        for attempt in range(LISTING_PAGE_RETRIES + 1):
+            if attempt:
+                # 接口报错多为请求过于频繁，等待后再试
+                sleep(LISTING_RETRY_BACKOFF * 2 ** (attempt - 1))
             try:
-                page_payload = payload.copy()
-                page_payload['pageNo'] = page_no
-                response = self.post(page_url, page_payload)
-                pages_data = json.loads(response)
+                pages_data = json.loads(self.post(page_url, page_payload))
                 if pages_data['code'] != 0:
                     print(f'爬取第{page_no}页数据时出错: {pages_data["msg"]}')
-                    return
+                    continue
                 page_data = pages_data['data']['page']
-                return page_no, page_data['list']
+                return page_no, page_data['list'], page_data
             except Exception as e:
                 print(f"获取第 {page_no} 页数据失败: {e}")
-                return page_no, []
+        logger.error(f"获取第 {page_no} 页数据失败，已重试 {LISTING_PAGE_RETRIES} 次")
+        return page_no, None, None
+
+    def _listing_product(self, item: dict) -> Product:
+        product_id = item['productId']
+        product = Product(product_id=product_id, url=item['sourceUrl'])
+        product.title = item['subject']
+        # 同步时就提取 ASIN，爬取时按 ASIN 去重
+        asin = extractor.extract_asin(product.url) if product.url else None
+        product.asin = asin.upper() if asin else None
+        product.owner = self.username
+        return product
 
-        # 使用线程池并行获取所有页面
-        products_in_web = []
+    def iter_listing_pages(self):
+        """
+        流式同步店小秘商品列表：第一页获取后立即返回，其余页面并发获取，按完成顺序逐页返回。
 
-        # 设置合适的线程数，可根据实际情况调整
-        max_workers = min(1, total_pages)  # 最多10个线程
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # 提交所有页面获取任务
-            future_to_page = {
-                executor.submit(fetch_page, page_no): page_no
-                for page_no in range(1, total_pages + 1)
-            }
+        :return: 生成 (page_no, 该页商品, 总页数, 商品总数)；重试后仍失败的页面商品为 None
+        """
+        if not self.online:
+            print(f'当前用户{self.username}未登录')
+            return
 
+        # 先获取第一页，得到总页数信息
+        _, first_items, page = self.fetch_listing_page(1)
+        if first_items is None:
+            return
+        total_pages = page['totalPage']
+        total_items = page['totalSize']
+        yield 1, self._listing_products(1, first_items), total_pages, total_items
+        if total_pages <= 1:
+            return
+
+        # 其余页面并发获取，并发数与连接池大小一致
+        max_workers = max(1, min(self.listing_concurrency, total_pages - 1))
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            futures = [executor.submit(self.fetch_listing_page, page_no) for page_no in range(2, total_pages + 1)]
             # 按完成顺序处理结果
-            for future in concurrent.futures.as_completed(future_to_page):
-                page_no = future_to_page[future]
-                try:
-                    page_no, items = future.result()
-                    for item in items:
-                        product_id = item['productId']
-                        product = Product(product_id=product_id, url=item['sourceUrl'])
-                        product.title = item['subject']
-                        product.owner = self.username
-                        products_in_web.append(product)
-                except Exception as e:
-                    print(f"处理第 {page_no} 页数据时出错: {e}")
-
-        # 处理结果
-        new_products = [p for p in products_in_web if p.product_id not in ids]
-        realtime_product_ids = [p.product_id for p in products_in_web]
-        expired_product_ids = [pid for pid in ids if pid not in realtime_product_ids]
-
-        return expired_product_ids, new_products, total_items
+            for future in concurrent.futures.as_completed(futures):
+                page_no, items, _ = future.result()
+                products = None if items is None else self._listing_products(page_no, items)
+                yield page_no, products, total_pages, total_items
+        finally:
+            # 调用方提前结束 (如停止爬取) 时取消尚未开始的页面
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def iter_listing_pages_delta(self, watermark: str = None):
+        """
+        增量同步：列表按上架时间倒序排列，从第一页起逐页获取，遇到上次同步时最新的商品 (watermark) 时停止；
+        调用方在遇到整页都是已保存的商品时也可以提前结束。
+        只能发现新增的商品，下架的商品需要完整同步才能发现。
+
+        :return: 与 iter_listing_pages 相同
+        """
+        if not self.online:
+            print(f'当前用户{self.username}未登录')
+            return
+        page_no = 1
+        while True:
+            _, items, page = self.fetch_listing_page(page_no)
+            if items is None:
+                yield page_no, None, 0, 0
+                return
+            products = self._listing_products(page_no, items)
+            yield page_no, products, page['totalPage'], page['totalSize']
+            page_ids = [str(p.product_id) for p in products]
+            if page_no >= page['totalPage'] or not page_ids or (watermark and watermark in page_ids):
+                return
+            page_no += 1
+
+    def _listing_products(self, page_no: int, items: list) -> List[Product]:
+        products = []
+        for item in items:
+            try:
+                products.append(self._listing_product(item))
+            except Exception as e:
+                print(f"处理第 {page_no} 页数据时出错: {e}")
+        return products
 
 
 class AmazonAgent(QObject):
-    def __init__(self):
+    def __init__(self, page_count: int = 1, cdp_endpoint: str = None, fetch_mode: str = FETCH_MODE_BROWSER,
+                 resource_policy: ResourcePolicy = None, pacer: AdaptivePacer = None,
+                 isolated_context: bool = False, watchdog: MemoryWatchdog = None,
+                 result_cache: AsinResultCache = None, launch_config: BrowserLaunchConfig = None):
+        """
+        :param page_count: 同一个 context 下使用的标签页数
+        :param cdp_endpoint: 比特浏览器窗口或浏览器服务的调试地址，提供时接管该浏览器而不是启动新的 Chrome
+        :param isolated_context: 连接 cdp_endpoint 后新建独立的 context，而不是沿用浏览器的默认 context
+        :param fetch_mode: browser 只用浏览器；tiered 先用 requests 获取，必要时再升级到浏览器
+        :param resource_policy: 资源拦截策略，None 表示不拦截
+        :param pacer: 请求节奏控制，同一个 agent 的所有标签页共用
+        :param watchdog: 按导航次数和浏览器内存判断何时重建 context
+        :param result_cache: 跨账号共用的 ASIN 结果缓存，命中时不再打开商品页
+        :param launch_config: 未提供 cdp_endpoint 时启动浏览器的配置 (有无界面、使用的浏览器)
+        """
         super().__init__()
+        self.fetch_mode = fetch_mode
+        self.cdp_endpoint = cdp_endpoint
+        # 是否使用自己创建的 context：自己创建的 context 会缓存会话状态，并在 stop 时关闭
+        self.isolated_context = isolated_context or not cdp_endpoint
+        self.pacer = pacer or AdaptivePacer()
+        self.health = ContextHealth()
+        self.watchdog = watchdog or MemoryWatchdog()
+        self.result_cache = result_cache
+        self.page_count = max(1, page_count)
+        # 各标签页发起导航的时间，用于统计加载耗时
+        self._nav_started = {}
+        # 各层获取成功的商品数，以及资源拦截节省的请求数/估算字节数
+        self.fetch_stats = {'http': 0, 'browser': 0, 'blocked_requests': 0, 'blocked_bytes': 0}
         # driver 对象启动 Chrome 浏览器
         self.amazon_session = requests.Session()
+        self.amazon_session.headers.update(AMAZON_HTTP_HEADERS)
         self.playwright = sync_playwright().start()
-        time.sleep(1.5)
-        # 启动浏览器 (这里使用 chromium，如果需要连接比特浏览器，需用 connect_over_cdp)
-        # 如果必须用比特浏览器，请告诉我，我需要修改这部分代码
-        self.browser = self.playwright.chromium.launch(
-            executable_path=r"C:\Program Files\Google\Chrome\Application\chrome.exe",
-            headless=False,
-            args=[
-                '--disable-blink-features=AutomationControlled',
-                '--no-sandbox',
-                '--disable-dev-shm-usage',
-                '--disable-web-security',
-                '--disable-features=IsolateOrigins,site-per-process'
-            ]
-        )
-
-        # 创建上下文，设置 UA 和 视口
-        self.context = self.browser.new_context(
-            viewport={"width": 1920, "height": 1080},
-            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/142.0.0.0 Safari/537.36",
-            locale="en-US",
-            timezone_id="America/New_York"
-        )
-
-        self.page = self.context.new_page()
-
-        # 注入脚本隐藏自动化特征 (解决 "检测到插件注入" 问题)
-        self.page.add_init_script("""
-                    Object.defineProperty(navigator, 'webdriver', {
-                        get: () => undefined
-                    });
-                    window.navigator.chrome = { runtime: {}, loadTimes: function() {}, csi: function() {} };
-                """)
+        context = None
+        if cdp_endpoint:
+            # 接管比特浏览器窗口，沿用其默认 context 以保留窗口的指纹和代理配置
+            self.browser = self.playwright.chromium.connect_over_cdp(cdp_endpoint)
+            if self.browser.contexts and not self.isolated_context:
+                context = self.browser.contexts[0]
+        else:
+            self.browser = self.playwright.chromium.launch(**(launch_config or BrowserLaunchConfig()).launch_options())
+        # 内存只采样本 agent 的浏览器进程树
+        if cdp_endpoint:
+            self.watchdog.track(cdp_endpoint=cdp_endpoint)
+        else:
+            self.watchdog.track(pid=playwright_driver_pid(self.playwright))
 
-        # 设置默认超时时间 (替代 implicitly_wait)
-        self.page.set_default_timeout(30000)
+        # 拦截图片、视频、字体和广告埋点等与解析无关的请求
+        self.resource_blocker = ResourceBlocker(resource_policy) if resource_policy is not None else None
 
         self.shopping_sys_session = requests.Session()
-        self._init_amazon_session()
+        self._open_context(context)
+
+    def _open_context(self, context=None, use_cached_state: bool = True):
+        """
+        准备 context 及其标签页池，并设置邮编、同步 Cookies。
 
-    def _init_amazon_session(self):
-        """初始化亚马逊会话，设置邮编等"""
+        新建的 context 优先载入缓存的会话状态，校验通过时跳过设置邮编的页面操作；
+        比特浏览器窗口自带持久化的配置，不注入缓存。
+        """
+        state = None
+        if context is None:
+            state = load_storage_state() if use_cached_state else None
+            # 创建上下文，设置 UA 和 视口
+            context = self.browser.new_context(**CONTEXT_OPTIONS, storage_state=state)
+        self.context = context
+
+        # 注入脚本隐藏自动化特征 (解决 "检测到插件注入" 问题)，挂在 context 上以覆盖所有标签页
+        self.context.add_init_script(STEALTH_SCRIPT)
+        if self.resource_blocker is not None:
+            self.resource_blocker.install(self.context)
+        self._open_pages(warm=state is not None)
+
+    def _open_pages(self, warm: bool = False):
+        """在当前 context 中打开标签页池，并重新设置邮编、同步 Cookies"""
+        self.page = self._new_page()
+        self._init_amazon_session(warm=warm)
+
+        # 页面池：同一个 context 下的多个标签页，共享邮编等会话状态
+        self.pages = [self.page]
+        for _ in range(self.page_count - 1):
+            self.pages.append(self._new_page())
+        self._nav_started.clear()
+        self.health.reset_window()
+        self.watchdog.reset()
+
+    def recycle_context(self, use_cached_state: bool = False):
+        """
+        丢弃当前 context (Cookies、缓存和被标记的会话一起丢弃)，换一个新的 context。
+        因内存或导航次数回收时会话本身没有问题，新建的 context 可以 use_cached_state 复用缓存的会话状态。
+        比特浏览器窗口的默认 context 带有窗口的指纹和代理配置，无法关闭也不能换成新建的 context：
+        沿用它，只清空 Cookies 并换一批标签页；先打开新标签页再关闭旧的，避免窗口因没有标签页而退出。
+        """
+        old_context = self.context
+        old_pages = list(self.pages)
+        is_window_default = bool(self.cdp_endpoint and self.browser.contexts) and \
+            old_context is self.browser.contexts[0]
+        self.amazon_session.cookies.clear()
+        if is_window_default:
+            self.context.clear_cookies()
+            self._open_pages()
+        else:
+            self._open_context(use_cached_state=use_cached_state)
         try:
-            self.page.goto("https://www.amazon.com/dp/B0F2DTDDFV?language=en_US", wait_until="domcontentloaded")
-            time.sleep(1.5)  # 稍微等待以防页面未完全渲染
+            if is_window_default:
+                for page in old_pages:
+                    page.close()
+            else:
+                old_context.close()
+        except Exception as e:
+            logger.warning(f"关闭旧 context 失败：{e}")
+        if self.resource_blocker is not None:
+            for page in old_pages:
+                self.resource_blocker.pop_stats(page)
+
+    def _new_page(self) -> Page:
+        page = self.context.new_page()
+        # 设置默认超时时间 (替代 implicitly_wait)
+        page.set_default_timeout(30000)
+        return page
+
+    def _init_amazon_session(self, warm: bool = False):
+        """
+        初始化亚马逊会话，设置邮编等
+
+        :param warm: context 已载入缓存的会话状态，校验通过即可跳过页面操作
+        """
+        if warm:
+            sync_cookies(self.amazon_session, self.context.cookies())
+            if zip_code_applied(self.amazon_session):
+                logger.info(f"复用缓存的会话状态 (邮编 {ZIP_CODE})")
+                return
+            logger.info("缓存的会话状态已失效，重新设置邮编")
+            self.amazon_session.cookies.clear()
+            self.context.clear_cookies()
+
+        try:
+            self.page.goto(ZIP_INIT_URL, wait_until="domcontentloaded")
 
             # 尝试点击 "Continue" (如果有)
             try:
@@ -301,294 +600,182 @@ class AmazonAgent(QObject):
                     submit_btn = self.page.locator('#GLUXZipUpdate input[type="submit"], #GLUXZipUpdate button')
                     if submit_btn.count() > 0:
                         submit_btn.first.click()
-                        time.sleep(1)  # 等待弹窗关闭
+                        # 等待弹窗关闭
+                        zip_input.wait_for(state="hidden", timeout=5000)
             except Exception as e:
                 print(f"设置邮编时出错或不需要设置：{e}")
 
             # 同步 Cookies 到 requests session
-            cookies = self.context.cookies()
-            for cookie in cookies:
-                self.amazon_session.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'],
-                                                path=cookie['path'])
+            sync_cookies(self.amazon_session, self.context.cookies())
+            if self.isolated_context and zip_code_applied(self.amazon_session):
+                save_storage_state(self.context.storage_state())
 
         except Exception as e:
             print(f"初始化亚马逊会话失败：{e}")
             logger.error(f"初始化亚马逊会话失败：{e}")
 
-    def start_craw(self, product: Product) -> Product:
+    def start_craw(self, product: Product, page: Page = None) -> Product:
         """
-        使用 Selenium 获取页面内容并进行解析。
+        使用 Playwright 获取页面内容并进行解析。
 
-        :param url: 目标商品 URL
         :param product: 包含商品数据的对象
-        :param logger: 日志对象
+        :param page: 使用的标签页，默认为 self.page
         :return: 更新后的 product 对象
         """
-        # 1. 导航到目标 URL
+        main_page_source = self.fetch_craw(product, page)
+        if main_page_source is None:
+            return product
+        return self.parse_page_source(product, main_page_source)
+
+    def fetch_craw(self, product: Product, page: Page = None):
+        """
+        获取阶段：只负责拿到商品页 HTML，不做解析。
+
+        :return: 待解析的页面源码；返回 None 表示 product 已处理完毕 (无链接、失效或验证码)
+        """
+        page = page or self.page
+        if self.serve_from_cache(product):
+            return None
+        self.pacer.acquire()
+        navigating, main_page_source = self.begin_craw(product, page)
+        if not navigating:
+            return main_page_source
+        return self.finish_fetch(product, page)
+
+    def serve_from_cache(self, product: Product) -> bool:
+        """命中 ASIN 结果缓存时直接填充 product 并返回 True，不占用令牌和标签页"""
+        return self.result_cache is not None and self.result_cache.apply(product)
+
+    def begin_craw(self, product: Product, page: Page, wait_until: str = "domcontentloaded"):
+        """
+        发起获取：tiered 模式下先尝试 HTTP，否则在指定标签页上发起导航。
+
+        wait_until="commit" 时只等待响应头返回，调用方可以随即去驱动其他标签页，
+        之后再通过 is_page_ready / finish_fetch 收取结果。
+        调用前需先从 self.pacer 取得令牌。
+        :return: (是否已发起导航, HTTP 获取到的页面源码)；两者都为空时 product 已经处理完毕
+        """
         url = product.url
         if url is None:
             product.invalid = True
             product.completed = True
             print(f'产品{product.product_id} 没有找到链接')
-            return product
-
-        # 2. 显式等待关键元素出现，判断页面是否加载成功
-        # 替代了 if status_code != 200: 的检查
-
-        main_page_source = None
+            return False, None
+        if self.fetch_mode == FETCH_MODE_TIERED:
+            # 第一层：用同步了 Cookies 和邮编的 requests 会话直接获取
+            main_page_source = http_fetch_product(self.amazon_session, product, pacer=self.pacer)
+            if main_page_source is not None:
+                self.fetch_stats['http'] += 1
+                return False, main_page_source
+            if product.completed:
+                return False, None
+        if self.resource_blocker is not None:
+            # 丢弃上一个商品残留的统计
+            self.resource_blocker.pop_stats(page)
+        self._nav_started[page] = time.monotonic()
+        self.watchdog.on_navigation()
         try:
-            # 1. 导航到 URL
             # Playwright 的 goto 默认会等待 networkidle 或 load，比 Selenium 更智能
-            response = self.page.goto(url, wait_until="domcontentloaded", timeout=30000)
-
-            # 2. 等待关键元素出现 (替代 WebDriverWait + any_of_elements_located)
-            # 策略：遍历选择器，只要有一个出现即可
-            found = False
-            for selector in KEY_SUCCESS_SELECTORS:
-                locator = self.page.locator(selector)
-                if locator.count() > 0:
-                    try:
-                        locator.first.wait_for(state="visible", timeout=5000)
-                        found = True
-                        break
-                    except PlaywrightTimeout:
-                        continue
-
-            if found:
-                main_page_source = self.page.content()
-            else:
-                # 如果没有找到关键元素，抛出异常进入 except 块处理
-                raise PlaywrightTimeout("关键元素未加载")
-
+            page.goto(url, wait_until=wait_until, timeout=30000)
         except Exception as e:
-            # 3. 异常处理 (404, 验证码，网络错误)
-            print(f'{url} 导航或等待元素失败：{e}')
-
-            # 获取当前页面源码进行判断
-            main_page_source = self.page.content()
-
-            # 检查 404
-            if "Sorry! We couldn't find that page" in main_page_source or "The requested URL was not found" in main_page_source:
-                print(f'{url} 链接失效，疑似 404 页面。')
-                logger.warning(f'{url} 链接失效，疑似 404 页面。')
-                product.completed = True
-                product.invalid = True
-                return product
-
-            # 检查验证码
-            if "Type the characters" in main_page_source or "Sorry, we just need to make sure you're not a robot" in main_page_source:
-                print(f'{url} 遇到亚马逊验证码/机器人检查页面。')
-                logger.warning(f'{url} 遇到亚马逊验证码/机器人检查页面。')
-                product.completed = False  # 标记为未完成，以便重试
-                return product
-
-            # 如果既不是 404 也不是验证码，可能是网络慢，尝试用 requests 兜底
-            try:
-                resp = self.amazon_session.get(url, timeout=10)
-                if resp.status_code == 404:
-                    product.completed = True
-                    product.invalid = True
-                    return product
-                elif resp.status_code != 200:
-                    print(f'{url} 链接失效，状态码：{resp.status_code}')
-                    product.completed = True
-                    product.invalid = True
-                    return product
-                main_page_source = resp.text
-            except Exception as req_err:
-                print(f'{url} Requests 兜底也失败：{req_err}')
-                product.completed = False
-                return product
-
-                # 4. 使用 BeautifulSoup 解析页面的最终 HTML 源代码
-        # 替代了 main_soup = BeautifulSoup(main_page.text, 'html.parser')
-        if not isinstance(main_page_source, (str, bytes)):
-            logger.error(f"resp.text 返回了意外的类型: {main_page_source}")
-            return product
-        main_soup = BeautifulSoup(main_page_source, 'html.parser')
+            # 导航异常交给 finish_fetch 根据页面状态判断 (404, 验证码，网络错误)
+            print(f'{url} 导航失败：{e}')
+        return True, None
 
-        # --- 以下是您原有的 Beautiful Soup 解析逻辑 (无需修改) ---
+    @staticmethod
+    def is_page_ready(page: Page) -> bool:
+        """标签页是否已经可以判定状态 (成功、验证码、404 或已完全加载)"""
+        try:
+            return page.evaluate(PAGE_STATE_SCRIPT) is not None
+        except Exception:
+            # 页面异常时直接交给 finish_fetch 处理
+            return True
 
-        # 无商品信息检查
-        learn_more_span = main_soup.select_one('#fod-cx-message-with-learn-more > span:nth-child(1)')
-        out_of_stock_div = main_soup.select_one('#outOfStock')
-        if learn_more_span or out_of_stock_div:
-            print(f'{url} 无商品信息')
-            logger.warning(f'{url} 无商品信息')
-            product.completed = True
-            product.invalid = True
-            return product
+    @staticmethod
+    def wait_for_page_state(page: Page, timeout: int = PAGE_STATE_TIMEOUT) -> str:
+        """
+        等待任意一个成功、验证码或 404 标记出现，并返回页面状态。
 
-        used_only_buy_box = main_soup.select_one('#usedOnlyBuybox')
-        if used_only_buy_box:
-            print(f'{url} 是二手商品')
-            product.used = True
-            product.completed = True
-            return product
-        used_div = main_soup.select_one('div#usedAccordionRow')
-        if used_div:
-            if main_soup.select_one('div[id^="newAccordionRow_"]') is None:
-                product.used = True
-                product.completed = True
-                return product
-        partial_state_box = main_soup.select_one('div#partialStateBuybox')
-        if partial_state_box:
-            product.completed = True
-            product.invalid = True
-            return product
-        new_product_div = main_soup.select_one('div[id^="newAccordionRow_"]')
-        shipping_from = ''
-        sold_by = ''
-        availability = False
-        if new_product_div is None:
-            buy_box_div = main_soup.select_one('#buybox')
-            if buy_box_div:
-                availability_span = buy_box_div.select_one('#availability > span')
-            else:
-                availability_span = None
-            if availability_span is None:
-                product.availability = False
-                product.completed = True
-                # 有价格显示考虑是有货的
-                core_price_feature_div = buy_box_div.select_one('#corePrice_feature_div')
-                if core_price_feature_div:
-                    availability = True
-            else:
-                availability_text = availability_span.text.lower()
-                availability = 'in stock' in availability_text or 'available to ship' in availability_text
-            if availability:
-                core_price_feature_div = buy_box_div.select_one('#corePrice_feature_div')
-                if core_price_feature_div:
-                    price_span = core_price_feature_div.select_one('span.a-offscreen')
-                else:
-                    price_span = None
-                if price_span:
-                    product.price = self.extract_price(price_span.text)
-                delivery_tag = buy_box_div.select_one(
-                    '#mir-layout-DELIVERY_BLOCK-slot-PRIMARY_DELIVERY_MESSAGE_LARGE > span')
-                if delivery_tag is None:
-                    delivery_tag = buy_box_div.select_one(
-                        '#mir-layout-DELIVERY_BLOCK-slot-NO_PROMISE_UPSELL_MESSAGE > a')
-                if delivery_tag:
-                    product.shipping_cost = delivery_tag.text.strip().split(' ')[0]
-                else:
-                    delivery_tag = buy_box_div.select_one(
-                        '#mir-layout-DELIVERY_BLOCK-slot-NO_PROMISE_UPSELL_MESSAGE')
-                    if delivery_tag:
-                        product.shipping_cost = delivery_tag.text.strip().split(' ')[0]
-                    else:
-                        print(f'{url} 无法获取运费信息')
-                ships_from_span = buy_box_div.select_one(
-                    '#fulfillerInfoFeature_feature_div > div.offer-display-feature-text.a-size-small > div.offer-display-feature-text.a-spacing-none.odf-truncation-popover > span')
-                if ships_from_span:
-                    shipping_from = ships_from_span.text.strip()
-                else:
-                    ships_from_new_span = main_soup.select_one('#sellerProfileTriggerId')
-                    if ships_from_new_span:
-                        shipping_from = ships_from_new_span.text.strip()
-                    else:
-                        ships_from_span = main_soup.select_one(
-                            '#merchantInfoFeature_feature_div > div.offer-display-feature-text.a-size-small > div.offer-display-feature-text.a-spacing-none.odf-truncation-popover > span')
-                        if ships_from_span:
-                            shipping_from = ships_from_span.text.strip()
-                        else:
-                            shipping_from = ''
-                            print(f'{url} 获取货源地信息失败')
-                sold_by_span = buy_box_div.select_one(
-                    '#merchantInfoFeature_feature_div > div.offer-display-feature-text.a-size-small > div.offer-display-feature-text.a-spacing-none.odf-truncation-popover.aok-inline-block')
-                if sold_by_span:
-                    sold_by = sold_by_span.text.strip()
-                else:
-                    sold_by_span = buy_box_div.select_one(
-                        '#merchantInfoFeature_feature_div > div.offer-display-feature-text.a-size-small > div.offer-display-feature-text.a-spacing-none.odf-truncation-popover > span')
-                    if sold_by_span:
-                        sold_by = sold_by_span.text.strip()
-                    else:
-                        sold_by = ''
-                        print(f'{url} 无法获取卖方信息')
-                product.shipping_from_amazon = shipping_from_amazon(shipping_from, sold_by)
-            else:
-                price_feature_div = main_soup.select_one('#corePrice_feature_div')
-                if price_feature_div:
-                    availability = True
-                    price_span = price_feature_div.select_one('span.a-offscreen')
-                    if price_span:
-                        product.price = self.extract_price(price_span.text)
-                    delivery_tag = main_soup.select_one(
-                        '#mir-layout-DELIVERY_BLOCK-slot-PRIMARY_DELIVERY_MESSAGE_LARGE > span')
-                    if delivery_tag:
-                        product.shipping_cost = delivery_tag.text.strip().split(' ')[0]
-                    shipping_from_span = main_soup.select_one('#fulfillerInfoFeature_feature_div > '
-                                                              'div.offer-display-feature-text.a-size-small > div.offer-display-feature-text.a-spacing-none.odf-truncation-popover > span')
-                    if shipping_from_span:
-                        shipping_from = shipping_from_span.text.strip()
-                    else:
-                        shipping_from = ''
-                    sold_by_span = main_soup.select_one('#sellerProfileTriggerId')
-                    if sold_by_span:
-                        sold_by = sold_by_span.text.strip()
-                    else:
-                        sold_by = ''
-                    product.shipping_from_amazon = shipping_from_amazon(shipping_from, sold_by)
-                availability = availability
-                product.completed = True
-        else:
-            availability_span = new_product_div.select_one('#availability > span')
-            if availability_span is None:
-                select_quantity = new_product_div.select_one('#selectQuantity')
-                availability = select_quantity is not None
-            else:
-                availability = 'in stock' in availability_span.text.lower()
-                availability = availability or 'available to ship' in availability_span.text.lower()
-            price_span = new_product_div.select_one(
-                '#corePrice_feature_div > div > div > div > div > span.a-price.a-text-normal.aok-align-center.reinventPriceAccordionT2 > span.a-offscreen')
-            if price_span is None:
-                product.invalid = True
-                product.completed = True
-                return product
-            product.price = self.extract_price(price_span.text)
-            shipping_info = new_product_div.select_one(
-                '#mir-layout-DELIVERY_BLOCK-slot-PRIMARY_DELIVERY_MESSAGE_MEDIUM')
-            if shipping_info is None:
-                shipping_info = new_product_div.select_one('#mir-layout-DELIVERY_BLOCK-slot-NO_PROMISE_UPSELL_MESSAGE')
-            if shipping_info:
-                product.shipping_cost = shipping_info.text.strip().split(' ')[0]
-            else:
-                print(f'{url} 获取运费信息失败')
-            shipping_from_span = new_product_div.select_one(
-                '#sfsb_accordion_head > div:nth-child(1) > div > span:nth-child(2)')
-            if shipping_from_span:
-                shipping_from = shipping_from_span.text.strip()
-            else:
-                shipping_from = ''
-                print(f'{url} 获取货源地信息失败')
-            sold_by_span = new_product_div.select_one(
-                '#sfsb_accordion_head > div:nth-child(2) > div > span:nth-child(2)')
-            if sold_by_span:
-                sold_by = sold_by_span.text.strip()
-            else:
-                sold_by = ''
-                print(f'{url} 获取卖方信息失败')
-        product.shipping_from_amazon = shipping_from_amazon(shipping_from, sold_by)
-        product.completed = True
-        product.availability = availability
-        return product
+        :return: ok / captcha / not_found / unknown (已加载但无标记) / timeout
+        """
+        try:
+            handle = page.wait_for_function(PAGE_STATE_SCRIPT, polling=200, timeout=timeout)
+            return handle.json_value()
+        except PlaywrightTimeout:
+            return PAGE_TIMEOUT
+        except Exception as e:
+            logger.warning(f'{page.url} 判断页面状态失败：{e}')
+            return PAGE_TIMEOUT
+
+    def finish_fetch(self, product: Product, page: Page, timeout: int = PAGE_STATE_TIMEOUT):
+        """
+        等待已发起导航的标签页加载完成，返回待解析的页面源码；
+        返回 None 表示 product 已处理完毕 (失效或验证码)
+        """
+        try:
+            return self._finish_fetch(product, page, timeout)
+        finally:
+            self._collect_block_stats(product, page)
+
+    def _collect_block_stats(self, product: Product, page: Page):
+        if self.resource_blocker is None:
+            return
+        stats = self.resource_blocker.pop_stats(page)
+        self.fetch_stats['blocked_requests'] += stats.requests
+        self.fetch_stats['blocked_bytes'] += stats.bytes
+        logger.debug(f'{product.url} 拦截 {stats.requests} 个请求，估算节省 {stats.bytes / 1024:.0f} KB，'
+                     f'明细: {stats.by_type}')
+
+    def _finish_fetch(self, product: Product, page: Page, timeout: int):
+        url = product.url
+        # 一次等待同时判定成功、验证码和 404，最坏情况只等待一个时限
+        state = self.wait_for_page_state(page, timeout)
+        started_at = self._nav_started.pop(page, None)
+        if started_at is not None:
+            self.health.record(state, time.monotonic() - started_at)
+        if state == PAGE_OK:
+            self.pacer.on_success()
+            main_page_source = page.content()
+            self.fetch_stats['browser'] += 1
+            return main_page_source
+        if state == PAGE_CAPTCHA:
+            self.pacer.on_throttle()
+
+        print(f'{url} 页面未正常加载：{state}')
+        product.last_error = state
+        if settle_page_state(product, state):
+            return None
+
+        # 如果既不是 404 也不是验证码，可能是网络慢，尝试用 requests 兜底
+        main_page_source = fetch_with_session(self.amazon_session, product, self.pacer)
+        if main_page_source is not None:
+            self.fetch_stats['browser'] += 1
+        return main_page_source
 
     @staticmethod
-    def extract_price(price_text):
-        logger.debug(f"price_span 类型: {type(price_text)}, 值: {price_text}")
-        match = re.search(r'\d{1,3}(?:,\d{3})*(?:\.\d+)?', price_text)
-        if match:
-            price = match.group()
-            return float(price.replace(',', ''))
-        else:
-            return 0
+    def parse_page_source(product: Product, main_page_source) -> Product:
+        """使用 BeautifulSoup 解析页面的最终 HTML 源代码"""
+        return parse_product_html(product, main_page_source)
+
+    extract_price = staticmethod(extract_price)
 
     def stop(self):
+        """
+        关闭自己创建的 context 和浏览器，只能在创建 agent 的线程中调用。
+        通过 CDP 连接的浏览器 (比特浏览器窗口、浏览器服务) 只断开连接，浏览器进程保持运行。
+        """
         try:
-            self.amazon_driver.close()
+            if self.isolated_context:
+                self.context.close()
+            if not self.cdp_endpoint:
+                self.browser.close()
         except Exception as e:
-            pass
+            logger.warning(f"关闭浏览器失败：{e}")
+        finally:
+            try:
+                self.playwright.stop()
+            except Exception:
+                pass
 
 
 if __name__ == '__main__':
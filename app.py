@@ -1,5 +1,6 @@
 import argparse
 import json
+import multiprocessing
 import os
 import platform
 import subprocess
@@ -22,6 +23,9 @@ from constant import *
 from db_util import AmazonDatabase
 from export import ExportWorker
 from logger import setup_concurrent_logging
+from browser_service import BrowserService
+from launch_config import LAUNCH_CONFIG_FILE, BrowserLaunchConfig
+from resource_policy import ResourcePolicy
 from util import curr_milliseconds, ensure_dir_exists
 from worker import CrawlWorker
 
@@ -34,6 +38,54 @@ def parse_arguments():
                        help='设置批量处理大小（默认: 100）')
     parser.add_argument('--use-bit', '-u', type=bool, default=False,
                        help='使用比特浏览器（默认: False）')
+    parser.add_argument('--pages', '-p', type=int, default=1,
+                       help='每个账号并发使用的标签页数（默认: 1）')
+    parser.add_argument('--engine', '-e', choices=['sync', 'async'], default='sync',
+                       help='爬取引擎：sync 为同步 Playwright，async 为异步 Playwright（默认: sync）')
+    parser.add_argument('--concurrency', '-c', type=int, default=50,
+                       help='异步引擎同时进行的导航数上限（默认: 50）')
+    parser.add_argument('--fetch-mode', '-f', choices=['browser', 'tiered'], default='browser',
+                       help='商品页获取方式：browser 只用浏览器，tiered 先用 HTTP 获取、必要时再用浏览器（默认: browser）')
+    parser.add_argument('--block-resources', type=str, default='none',
+                       help='浏览器中拦截的资源类型，逗号分隔，如 image,media,font；'
+                            '拦截需要启用请求路由，浏览器将不再使用 HTTP 缓存（默认: none）')
+    parser.add_argument('--block-domains', type=str, default=None,
+                       help='浏览器中拦截的域名，逗号分隔，default 表示内置的广告埋点域名，none 表示不按域名拦截'
+                            '（默认: 按类型拦截时同时拦截内置域名）')
+    parser.add_argument('--parse-workers', type=int, default=0,
+                       help='解析进程数，0 表示在爬取线程中直接解析（默认: 0）')
+    parser.add_argument('--variant-prefetch', action='store_true',
+                       help='已有完整结果的商品先按父 ASIN 批量通过变体接口刷新价格和库存，其余商品加载完整页面')
+    parser.add_argument('--rate', type=float, default=2.0,
+                       help='每个浏览器窗口的初始请求速率（次/秒），遇到验证码或 503 时自动减半（默认: 2.0）')
+    parser.add_argument('--max-rate', type=float, default=5.0,
+                       help='请求成功时速率逐步恢复的上限（次/秒）（默认: 5.0）')
+    parser.add_argument('--refresh-budget', type=int, default=0,
+                       help='每次运行最多重新爬取多少个已过期的已完成商品，0 表示不刷新（默认: 0）')
+    parser.add_argument('--refresh-age', type=float, default=24,
+                       help='已完成商品超过多少小时未更新视为过期（默认: 24）')
+    parser.add_argument('--browser-service', type=int, default=0,
+                       help='程序启动时预先拉起的共享浏览器进程数，所有账号从中租用独立的 context，'
+                            '0 表示每个账号各自启动浏览器（默认: 0）')
+    parser.add_argument('--recycle-after', type=int, default=300,
+                       help='同一个浏览器 context 导航多少次后重建，0 表示不按次数重建（默认: 300）')
+    parser.add_argument('--rss-limit', type=int, default=3072,
+                       help='浏览器进程总内存超过多少 MB 时重建 context，需要安装 psutil，0 表示不检查（默认: 3072）')
+    parser.add_argument('--headless', action='store_true', default=None,
+                       help='以无界面模式启动浏览器，适合没有显示器的服务器（默认读取浏览器配置文件，未配置时有界面）')
+    parser.add_argument('--browser-channel', type=str, default=None,
+                       help='使用的 Chrome 渠道，如 chrome、chrome-beta、msedge（默认使用本机 Chrome 或自带的 Chromium）')
+    parser.add_argument('--browser-path', type=str, default=None,
+                       help='浏览器可执行文件路径，优先于 --browser-channel')
+    parser.add_argument('--browser-config', type=str, default=str(LAUNCH_CONFIG_FILE),
+                       help=f'浏览器启动配置文件 (JSON)，命令行参数优先（默认: {LAUNCH_CONFIG_FILE}）')
+    parser.add_argument('--listing-concurrency', type=int, default=4,
+                       help='同步店小秘商品列表时同时请求的页数（默认: 4）')
+    parser.add_argument('--full-sync-hours', type=float, default=24,
+                       help='商品列表平时只增量同步新商品，每隔多少小时完整同步一次以清理下架商品，'
+                            '0 表示每次都完整同步（默认: 24）')
+    parser.add_argument('--cache-ttl', type=float, default=12,
+                       help='各账号共用的 ASIN 爬取结果缓存有效期（小时），0 表示不使用缓存（默认: 12）')
     return parser.parse_args()
 
 
@@ -618,7 +670,22 @@ class MainWindow(QWidget):
         self.batch_size = args.batch_size
 
         # 在状态栏显示当前配置
-        print(f"命令行配置: workers={self.max_workers}, batch_size={self.batch_size}, use_bit={args.use_bit}")
+        print(f"命令行配置: workers={self.max_workers}, batch_size={self.batch_size}, use_bit={args.use_bit}, "
+              f"pages={args.pages}, engine={args.engine}, concurrency={args.concurrency}, "
+              f"fetch_mode={args.fetch_mode}, block_resources={args.block_resources}, block_domains={args.block_domains}, "
+              f"parse_workers={args.parse_workers}, variant_prefetch={args.variant_prefetch}, "
+              f"rate={args.rate}, max_rate={args.max_rate}, "
+              f"refresh_budget={args.refresh_budget}, refresh_age={args.refresh_age}, "
+              f"browser_service={args.browser_service}, recycle_after={args.recycle_after}, "
+              f"rss_limit={args.rss_limit}, cache_ttl={args.cache_ttl}, "
+              f"listing_concurrency={args.listing_concurrency}, full_sync_hours={args.full_sync_hours}")
+        self.launch_config = BrowserLaunchConfig.load(args.browser_config, headless=args.headless,
+                                                      channel=args.browser_channel, executable_path=args.browser_path)
+        print(f"浏览器配置: {self.launch_config.describe()}")
+        # 共享浏览器服务：启动时预热浏览器进程，各账号的爬取任务从中租用
+        self.browser_service = BrowserService(instances=args.browser_service,
+                                              launch_config=self.launch_config).start() \
+            if args.browser_service > 0 else None
         ensure_dir_exists(self.export_path)
         self.init_ui()
         self.load_accounts()
@@ -1284,6 +1351,10 @@ class MainWindow(QWidget):
             # 停止所有Agent的爬取任务
             self.stop_all_agents()
 
+            # 关闭共享浏览器服务
+            if self.browser_service is not None:
+                self.browser_service.stop()
+
             # 关闭所有控制台窗口
             self.close_all_consoles()
 
@@ -1409,7 +1480,7 @@ class MainWindow(QWidget):
 
     def add_account(self):
         """添加新账号"""
-        agent = Agent()
+        agent = Agent(listing_concurrency=args.listing_concurrency)
         self.login_window = LoginWindow(agent)
         self.login_window.login_success_callback = self.on_login_success
         self.login_window.setWindowModality(Qt.ApplicationModal)
@@ -1434,7 +1505,7 @@ class MainWindow(QWidget):
         try:
             self.accounts_data = db.get_all_accounts()
             for (username, password) in self.accounts_data:
-                agent = Agent()
+                agent = Agent(listing_concurrency=args.listing_concurrency)
                 agent.login(username)
                 self.agents[username] = agent
                 self.accounts[username] = True
@@ -1686,7 +1757,24 @@ class MainWindow(QWidget):
                 logger=logger,
                 max_workers=self.max_workers,
                 batch_size=self.batch_size,
-                use_bit=args.use_bit
+                use_bit=args.use_bit,
+                page_count=args.pages,
+                engine=args.engine,
+                concurrency=args.concurrency,
+                fetch_mode=args.fetch_mode,
+                resource_policy=ResourcePolicy.from_option(args.block_resources, args.block_domains),
+                parse_workers=args.parse_workers,
+                variant_prefetch=args.variant_prefetch,
+                pacing_rate=args.rate,
+                pacing_max_rate=args.max_rate,
+                refresh_budget=args.refresh_budget,
+                refresh_max_age=args.refresh_age,
+                browser_service=self.browser_service,
+                recycle_after=args.recycle_after,
+                rss_limit_mb=args.rss_limit,
+                cache_ttl=args.cache_ttl,
+                launch_config=self.launch_config,
+                full_sync_hours=args.full_sync_hours
             )
 
             self.crawl_threads[username] = QThread()
@@ -2293,6 +2381,8 @@ def activate_window(expired_window, device_code):
 
 # 修改最后的主程序部分
 if __name__ == '__main__':
+    # 打包后的程序需要支持解析进程池的子进程启动
+    multiprocessing.freeze_support()
     # 设置全局异常处理
     sys.excepthook = excepthook
     app = QApplication(sys.argv)
@@ -0,0 +1,144 @@
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List
+
+from bean import Product
+from logger import setup_concurrent_logging
+from util import ensure_dir_exists
+
+logger = setup_concurrent_logging()
+
+DEFAULT_DB_NAME = ".cache/db/amazon_products.db"
+# 缓存结果的默认有效期 (小时)
+DEFAULT_TTL_HOURS = 12
+
+
+class AsinResultCache:
+    """
+    按 ASIN 缓存的爬取结果，所有账号共用，同一天内不同账号的相同商品页只加载一次。
+
+    每个线程使用自己的 SQLite 连接，数据库开启 WAL，多个 CrawlWorker 可以同时读写。
+    运行结束后调用 close 关闭所有线程的连接。
+    """
+
+    def __init__(self, ttl_hours: float = DEFAULT_TTL_HOURS, db_name: str = DEFAULT_DB_NAME):
+        ensure_dir_exists(Path(db_name).parent)
+        self.db_name = db_name
+        self.ttl_hours = ttl_hours
+        self.hits = 0
+        self.misses = 0
+        # 本次运行中由缓存提供结果的 ASIN，写库时不再回填缓存，以免延长过期时间
+        self._served_asins = set()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # 所有线程打开的连接，close 时统一关闭
+        self._connections = []
+        self._create_table()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # 连接只在打开它的线程中使用，但运行结束时由 close 在其他线程关闭
+            conn = sqlite3.connect(self.db_name, timeout=30, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _create_table(self):
+        try:
+            conn = self._connection()
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS asin_cache (
+                    asin TEXT PRIMARY KEY,
+                    price REAL,
+                    used INTEGER,
+                    availability INTEGER,
+                    shipping_from_amazon TEXT,
+                    shipping_cost TEXT,
+                    invalid INTEGER DEFAULT 0,
+                    fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_asin_cache_fetched ON asin_cache (fetched_at)')
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"创建 ASIN 缓存表错误: {e}")
+
+    def apply(self, product: Product) -> bool:
+        """命中未过期的缓存时把结果写入 product 并返回 True"""
+        if not product.asin:
+            return False
+        try:
+            row = self._connection().execute('''
+                SELECT * FROM asin_cache
+                WHERE asin = ? AND fetched_at > datetime('now', ?)
+            ''', (product.asin, f'-{float(self.ttl_hours)} hours')).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"读取 ASIN 缓存错误: {e}")
+            row = None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return False
+            self.hits += 1
+            self._served_asins.add(product.asin)
+        product.price = row['price']
+        product.used = None if row['used'] is None else row['used'] == 1
+        product.availability = row['availability'] == 1
+        product.shipping_from_amazon = row['shipping_from_amazon'] == '1'
+        product.shipping_cost = row['shipping_cost']
+        product.invalid = row['invalid'] == 1
+        product.completed = True
+        return True
+
+    def put_many(self, products: List[Product]):
+        """回填本次实际爬取到的成功结果"""
+        with self._lock:
+            # 同一 ASIN 的多个商品共用一条缓存
+            fresh = {p.asin: p for p in products if p.asin and p.completed and p.asin not in self._served_asins}
+        if not fresh:
+            return
+        conn = self._connection()
+        try:
+            conn.executemany('''
+                INSERT OR REPLACE INTO asin_cache
+                (asin, price, used, availability, shipping_from_amazon, shipping_cost, invalid, fetched_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ''', [(p.asin, p.price, p.used, p.availability, p.shipping_from_amazon, p.shipping_cost, p.invalid)
+                  for p in fresh.values()])
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"写入 ASIN 缓存错误: {e}")
+            conn.rollback()
+
+    def evict_expired(self) -> int:
+        """删除过期的缓存，返回删除的条数"""
+        conn = self._connection()
+        try:
+            cursor = conn.execute('DELETE FROM asin_cache WHERE fetched_at <= datetime(\'now\', ?)',
+                                  (f'-{float(self.ttl_hours)} hours',))
+            conn.commit()
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            print(f"清理 ASIN 缓存错误: {e}")
+            conn.rollback()
+            return 0
+
+    def close(self):
+        """关闭所有线程打开的连接，之后不能再使用该缓存"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f"关闭 ASIN 缓存连接错误: {e}")
+
+    def describe(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0
+        return f"ASIN 缓存命中 {self.hits} 次，未命中 {self.misses} 次，命中率 {rate:.1f}%"
@@ -0,0 +1,303 @@
+import asyncio
+import time
+from concurrent.futures import Executor
+
+import requests
+from playwright.async_api import async_playwright, Page, TimeoutError as PlaywrightTimeout
+
+from agent import (CONTEXT_OPTIONS, PAGE_STATE_SCRIPT,
+                   PAGE_STATE_TIMEOUT, STEALTH_SCRIPT, ZIP_CODE, ZIP_INIT_URL, fetch_with_session, load_storage_state,
+                   save_storage_state, settle_page_state, sync_cookies, zip_code_applied)
+from asin_cache import AsinResultCache
+from bean import Product
+from context_health import ContextHealth
+from http_fetch import (AMAZON_HTTP_HEADERS, FETCH_MODE_BROWSER, FETCH_MODE_TIERED, PAGE_CAPTCHA, PAGE_OK,
+                        PAGE_TIMEOUT, http_fetch_product)
+from launch_config import BrowserLaunchConfig
+from logger import setup_concurrent_logging
+from memory_watchdog import MemoryWatchdog, playwright_driver_pid
+from pacing import AdaptivePacer
+from page_parser import parse_product_html
+from resource_policy import ResourceBlocker, ResourcePolicy
+
+logger = setup_concurrent_logging()
+
+
+class AsyncAmazonAgent:
+    """
+    基于 playwright.async_api 的亚马逊爬取引擎。
+
+    一个事件循环内同时驱动大量导航，每个商品使用独立的标签页，
+    并发数由信号量限制。
+    """
+
+    def __init__(self, concurrency: int = 50, fetch_mode: str = FETCH_MODE_BROWSER,
+                 resource_policy: ResourcePolicy = None, parse_executor: Executor = None,
+                 pacer: AdaptivePacer = None, cdp_endpoint: str = None, watchdog: MemoryWatchdog = None,
+                 result_cache: AsinResultCache = None, launch_config: BrowserLaunchConfig = None):
+        """
+        :param cdp_endpoint: 浏览器服务的调试地址，提供时连接该浏览器并新建独立的 context，而不是启动新的 Chrome
+        :param parse_executor: 解析使用的执行器 (如进程池)，默认为事件循环的线程池
+        :param pacer: 请求节奏控制；concurrency 限制同时进行的导航数，pacer 限制发起导航的速率
+        :param result_cache: 跨账号共用的 ASIN 结果缓存，命中时不再打开商品页
+        :param launch_config: 未提供 cdp_endpoint 时启动浏览器的配置
+        """
+        self.concurrency = max(1, concurrency)
+        self.parse_executor = parse_executor
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.fetch_mode = fetch_mode
+        self.cdp_endpoint = cdp_endpoint
+        self.pacer = pacer or AdaptivePacer()
+        self.health = ContextHealth()
+        self.watchdog = watchdog or MemoryWatchdog()
+        self.result_cache = result_cache
+        self.launch_config = launch_config or BrowserLaunchConfig()
+        # 熔断后只允许一个协程执行隔离和重建，其余协程在此等待
+        self._recycle_lock = asyncio.Lock()
+        self.resource_blocker = ResourceBlocker(resource_policy) if resource_policy is not None else None
+        # 各层获取成功的商品数，以及资源拦截节省的请求数/估算字节数
+        self.fetch_stats = {'http': 0, 'browser': 0, 'blocked_requests': 0, 'blocked_bytes': 0}
+        self.amazon_session = requests.Session()
+        self.amazon_session.headers.update(AMAZON_HTTP_HEADERS)
+        self.playwright = None
+        self.browser = None
+        self.context = None
+
+    async def start(self):
+        """启动浏览器并初始化亚马逊会话"""
+        self.playwright = await async_playwright().start()
+        if self.cdp_endpoint:
+            self.browser = await self.playwright.chromium.connect_over_cdp(self.cdp_endpoint)
+        else:
+            self.browser = await self.playwright.chromium.launch(**self.launch_config.launch_options())
+        # 内存只采样本 agent 的浏览器进程树
+        if self.cdp_endpoint:
+            self.watchdog.track(cdp_endpoint=self.cdp_endpoint)
+        else:
+            self.watchdog.track(pid=playwright_driver_pid(self.playwright))
+        await self._open_context()
+        return self
+
+    async def _open_context(self, use_cached_state: bool = True):
+        """新建 context，优先载入缓存的会话状态"""
+        state = load_storage_state() if use_cached_state else None
+        self.context = await self.browser.new_context(**CONTEXT_OPTIONS, storage_state=state)
+        await self.context.add_init_script(STEALTH_SCRIPT)
+        if self.resource_blocker is not None:
+            await self.resource_blocker.install_async(self.context)
+        await self._init_amazon_session(warm=state is not None)
+        self.health.reset_window()
+        self.watchdog.reset()
+
+    async def _ensure_healthy(self):
+        """
+        context 不健康时熔断：暂停发起新导航，冷却期间让进行中的导航自然结束，
+        然后换一个新的 context 并重新设置邮编。
+        导航次数或内存达到上限时，等进行中的导航结束后直接重建 context。
+        """
+        async with self._recycle_lock:
+            if self.health.is_unhealthy():
+                message = f"[熔断] 浏览器 context 不健康 ({self.health.describe()})"
+                cool_down = self.health.trip()
+                print(f"{message}，隔离 {cool_down:.0f} 秒后重建")
+                logger.warning(f"{message}，隔离 {cool_down:.0f} 秒后重建")
+                await asyncio.sleep(cool_down)
+                # 重建是因为当前会话已被标记，不能再复用缓存的会话状态
+                await self._recycle_context(use_cached_state=False)
+                return
+            reason = self.watchdog.recycle_reason()
+            if reason is not None:
+                print(f"[回收] 浏览器 context {reason}，重建 context")
+                logger.info(f"[回收] 浏览器 context {reason}，重建 context")
+                await self._recycle_context(use_cached_state=True)
+
+    async def _recycle_context(self, use_cached_state: bool):
+        """占满所有并发名额，等进行中的导航结束后再替换 context，队列中的商品不受影响"""
+        for _ in range(self.concurrency):
+            await self.semaphore.acquire()
+        try:
+            old_context = self.context
+            self.amazon_session.cookies.clear()
+            await self._open_context(use_cached_state=use_cached_state)
+            try:
+                await old_context.close()
+            except Exception as e:
+                logger.warning(f"关闭旧 context 失败：{e}")
+        finally:
+            for _ in range(self.concurrency):
+                self.semaphore.release()
+
+    async def _new_page(self) -> Page:
+        page = await self.context.new_page()
+        page.set_default_timeout(30000)
+        return page
+
+    async def _init_amazon_session(self, warm: bool = False):
+        """
+        初始化亚马逊会话，设置邮编等
+
+        :param warm: context 已载入缓存的会话状态，校验通过即可跳过页面操作
+        """
+        if warm:
+            sync_cookies(self.amazon_session, await self.context.cookies())
+            if await asyncio.to_thread(zip_code_applied, self.amazon_session):
+                logger.info(f"复用缓存的会话状态 (邮编 {ZIP_CODE})")
+                return
+            logger.info("缓存的会话状态已失效，重新设置邮编")
+            self.amazon_session.cookies.clear()
+            await self.context.clear_cookies()
+
+        page = await self._new_page()
+        try:
+            await page.goto(ZIP_INIT_URL, wait_until="domcontentloaded")
+
+            # 尝试点击 "Continue" (如果有)
+            try:
+                continue_btn = page.locator('button:has-text("Continue"), button:has-text("继续")')
+                if await continue_btn.count() > 0:
+                    await continue_btn.first.click(timeout=5000)
+                    print('Click continue')
+            except Exception:
+                pass  # 没找到按钮也没关系
+
+            # 处理邮编
+            try:
+                address_locator = page.locator("#glow-ingress-line2")
+                await address_locator.wait_for(state="visible", timeout=10000)
+
+                current_address = (await address_locator.inner_text()).strip()
+                if ZIP_CODE not in current_address:
+                    await address_locator.click()
+
+                    zip_input = page.locator("#GLUXZipUpdateInput")
+                    await zip_input.wait_for(state="visible", timeout=10000)
+                    await zip_input.fill(ZIP_CODE)
+
+                    submit_btn = page.locator('#GLUXZipUpdate input[type="submit"], #GLUXZipUpdate button')
+                    if await submit_btn.count() > 0:
+                        await submit_btn.first.click()
+                        # 等待弹窗关闭
+                        await zip_input.wait_for(state="hidden", timeout=5000)
+            except Exception as e:
+                print(f"设置邮编时出错或不需要设置：{e}")
+
+            # 同步 Cookies 到 requests session
+            sync_cookies(self.amazon_session, await self.context.cookies())
+            if await asyncio.to_thread(zip_code_applied, self.amazon_session):
+                save_storage_state(await self.context.storage_state())
+        except Exception as e:
+            print(f"初始化亚马逊会话失败：{e}")
+            logger.error(f"初始化亚马逊会话失败：{e}")
+        finally:
+            await page.close()
+            if self.resource_blocker is not None:
+                self.resource_blocker.pop_stats(page)
+
+    async def start_craw(self, product: Product) -> Product:
+        """
+        异步获取页面内容并进行解析，同时进行中的导航数不超过 concurrency。
+
+        :param product: 包含商品数据的对象
+        :return: 更新后的 product 对象
+        """
+        url = product.url
+        if url is None:
+            product.invalid = True
+            product.completed = True
+            print(f'产品{product.product_id} 没有找到链接')
+            return product
+        # 缓存查询是阻塞的 SQLite 读取，放到线程中执行，不阻塞其他进行中的页面
+        if self.result_cache is not None and await asyncio.to_thread(self.result_cache.apply, product):
+            return product
+
+        await self._ensure_healthy()
+        async with self.semaphore:
+            await self.pacer.acquire_async()
+            main_page_source = None
+            if self.fetch_mode == FETCH_MODE_TIERED:
+                # 第一层：requests 直接获取，只有验证码、JS 壳页面或缺少购买区时才打开浏览器
+                main_page_source = await asyncio.to_thread(http_fetch_product, self.amazon_session, product,
+                                                          pacer=self.pacer)
+                if main_page_source is None and product.completed:
+                    return product
+            if main_page_source is None:
+                main_page_source = await self._fetch_page_source(product)
+                if main_page_source is not None:
+                    self.fetch_stats['browser'] += 1
+            else:
+                self.fetch_stats['http'] += 1
+        if main_page_source is None:
+            return product
+
+        # 解析是 CPU 密集操作，放到执行器中避免阻塞事件循环；进程池返回的是新的 product 对象
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.parse_executor, parse_product_html, product, main_page_source)
+
+    async def _fetch_page_source(self, product: Product):
+        """导航并等待关键元素，返回页面源码；返回 None 表示 product 已被标记"""
+        url = product.url
+        page = await self._new_page()
+        try:
+            started_at = time.monotonic()
+            self.watchdog.on_navigation()
+            try:
+                await page.goto(url, wait_until="domcontentloaded", timeout=30000)
+            except Exception as e:
+                # 导航异常交给页面状态判断 (404, 验证码，网络错误)
+                print(f'{url} 导航失败：{e}')
+            state = await self._wait_for_page_state(page)
+            self.health.record(state, time.monotonic() - started_at)
+            if state == PAGE_OK:
+                self.pacer.on_success()
+                return await page.content()
+            if state == PAGE_CAPTCHA:
+                self.pacer.on_throttle()
+            print(f'{url} 页面未正常加载：{state}')
+            product.last_error = state
+            if settle_page_state(product, state):
+                return None
+        except Exception as e:
+            print(f'{url} 获取页面源码失败：{e}')
+            logger.error(f'{url} 获取页面源码失败：{e}')
+            product.last_error = 'browser_error'
+        finally:
+            await page.close()
+            self._collect_block_stats(product, page)
+
+        # 如果既不是 404 也不是验证码，可能是网络慢，尝试用 requests 兜底
+        return await asyncio.to_thread(fetch_with_session, self.amazon_session, product, self.pacer)
+
+    @staticmethod
+    async def _wait_for_page_state(page: Page, timeout: int = PAGE_STATE_TIMEOUT) -> str:
+        """一次等待同时判定成功、验证码和 404 页面"""
+        try:
+            handle = await page.wait_for_function(PAGE_STATE_SCRIPT, polling=200, timeout=timeout)
+            return await handle.json_value()
+        except PlaywrightTimeout:
+            return PAGE_TIMEOUT
+        except Exception as e:
+            logger.warning(f'{page.url} 判断页面状态失败：{e}')
+            return PAGE_TIMEOUT
+
+    def _collect_block_stats(self, product: Product, page: Page):
+        if self.resource_blocker is None:
+            return
+        stats = self.resource_blocker.pop_stats(page)
+        self.fetch_stats['blocked_requests'] += stats.requests
+        self.fetch_stats['blocked_bytes'] += stats.bytes
+        logger.debug(f'{product.url} 拦截 {stats.requests} 个请求，估算节省 {stats.bytes / 1024:.0f} KB，'
+                     f'明细: {stats.by_type}')
+
+    async def stop(self):
+        """关闭 context；连接的浏览器服务只断开连接，不关闭浏览器进程"""
+        closables = [self.context] if self.cdp_endpoint else [self.context, self.browser]
+        for closable in closables:
+            if closable is None:
+                continue
+            try:
+                await closable.close()
+            except Exception:
+                pass
+        if self.playwright is not None:
+            await self.playwright.stop()
+            self.playwright = None
@@ -1,3 +1,4 @@
+import hashlib
 from dataclasses import dataclass
 from datetime import time, datetime
 
@@ -23,6 +24,31 @@ class Product:
     created_at: time = None
     updated_at: time = None
     invalid: bool = False
+    # 变体所属的父 ASIN，从商品页解析，变体接口按父 ASIN 分批请求
+    parent_asin: str = None
+    # 失败次数和最近一次失败原因 (captcha、timeout 等)，用于重试调度
+    attempts: int = 0
+    last_error: str = None
+
+    def copy_result(self, source: 'Product'):
+        """把同一 ASIN 的爬取结果复制到当前商品，商品自己的编号、链接和重试次数保持不变"""
+        self.asin = source.asin
+        self.parent_asin = source.parent_asin or self.parent_asin
+        self.used = source.used
+        self.price = source.price
+        self.shipping_cost = source.shipping_cost
+        self.shipping_from_amazon = source.shipping_from_amazon
+        self.availability = source.availability
+        self.completed = source.completed
+        self.invalid = source.invalid
+        self.last_error = source.last_error
+
+    def fingerprint(self) -> str:
+        """爬取结果的指纹：价格、库存、运费、二手、发货方和失效状态，任意一项变化指纹就不同"""
+        price = None if self.price is None else round(float(self.price), 2)
+        fields = (price, bool(self.availability), self.shipping_cost, bool(self.used),
+                  bool(self.shipping_from_amazon), bool(self.invalid))
+        return hashlib.blake2b(repr(fields).encode(), digest_size=8).hexdigest()
 
 @dataclass
 class Device:
@@ -7,13 +7,16 @@ from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
 from playwright.sync_api import sync_playwright
+
+from launch_config import find_chrome
 # 配置区域
 
 os.environ['WDM_LOCAL'] = '1' # 优先使用本地缓存
 os.environ['WDM_SSL_VERIFY'] = '0' # 如果证书有问题可尝试关闭验证
 
 BITBROWSER_API_URL = "http://127.0.0.1:54345"  # 比特浏览器默认 API 地址
-CHROMEDRIVER_PATH = r"chromedriver.exe"  # 你的对应版本的驱动路径
+# 你的对应版本的驱动路径，可通过环境变量 CHROMEDRIVER_PATH 指定
+CHROMEDRIVER_PATH = os.environ.get('CHROMEDRIVER_PATH', 'chromedriver.exe' if os.name == 'nt' else 'chromedriver')
 headers = {'Content-Type': 'application/json'}
 
 
@@ -23,25 +26,28 @@ def get_playwright_driver():
     return browser
 
 
-def get_chrome_driver():
+def get_chrome_driver(headless: bool = False):
     """
     启动 Chrome 浏览器并返回 Selenium Driver 对象
+
+    :param headless: 无界面模式，适合没有显示器的服务器
     """
     chrome_options = Options()
+    if headless:
+        chrome_options.add_argument('--headless=new')
     chrome_options.add_argument('--disable-blink-features=AutomationControlled')
     chrome_options.add_argument('--no-sandbox')
     chrome_options.add_argument('--disable-dev-shm-usage')
     chrome_options.add_argument('--disable-gpu')
     chrome_options.add_argument('--log-level=3')
     service = Service(ChromeDriverManager(url="https://npmmirror.com/mirrors/chromedriver/").install())
-    driver = webdriver.Chrome(service=service)
+    driver = webdriver.Chrome(service=service, options=chrome_options)
     return driver
 
-def get_bitbrowser_driver(browser_id):
+def open_bitbrowser(browser_id):
     """
-    启动比特浏览器窗口并返回 Selenium Driver 对象
+    请求比特浏览器接口打开窗口，返回调试地址 (host:port)，失败返回 None
     """
-    # 1. 请求比特浏览器接口打开窗口
     open_url = f"{BITBROWSER_API_URL}/browser/open"
     # --- 关键修改：设置启动参数 (args) ---
     custom_args = [
@@ -69,10 +75,30 @@ def get_bitbrowser_driver(browser_id):
         print(f"启动窗口失败: {resp.get('msg')}")
         return None
 
-    # 2. 获取调试地址和驱动路径
     # API 返回示例: {'data': {'http': '127.0.0.1:53868', 'driver': '...'}, ...}
     debug_address = resp["data"]["http"]
     print(f"窗口已启动，调试地址: {debug_address}")
+    return debug_address
+
+
+def get_bitbrowser_cdp_endpoint(browser_id):
+    """
+    启动比特浏览器窗口并返回 Playwright connect_over_cdp 可用的地址
+    """
+    debug_address = open_bitbrowser(browser_id)
+    if not debug_address:
+        return None
+    return f"http://{debug_address}"
+
+
+def get_bitbrowser_driver(browser_id):
+    """
+    启动比特浏览器窗口并返回 Selenium Driver 对象
+    """
+    # 1. 请求比特浏览器接口打开窗口，获取调试地址
+    debug_address = open_bitbrowser(browser_id)
+    if not debug_address:
+        return None
 
     # 3. 配置 Selenium 接管
     chrome_options = Options()
@@ -137,8 +163,7 @@ if __name__ == "__main__":
 
     with sync_playwright() as p:
         browser = p.chromium.launch(
-            executable_path=r"C:\Program Files\Google\Chrome\Application\chrome.exe",  # Windows 示例
-            # executable_path="/Applications/Google Chrome.app/Contents/MacOS/Google Chrome", # Mac 示例
+            executable_path=find_chrome(),  # 本机安装的 Chrome，未安装时使用自带的 Chromium
             headless=False
         )
 
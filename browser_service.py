@@ -0,0 +1,144 @@
+import socket
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+import requests
+
+from constant import CACHE_DIR
+from launch_config import BrowserLaunchConfig
+from logger import setup_concurrent_logging
+from util import ensure_dir_exists
+
+logger = setup_concurrent_logging()
+
+# 每个浏览器实例的用户数据目录，磁盘缓存在多次运行之间保留 (启用资源拦截的 context 不使用 HTTP 缓存)
+SERVICE_DATA_DIR = Path(CACHE_DIR) / 'browser_service'
+# 等待浏览器调试端口就绪的时间 (秒)
+STARTUP_TIMEOUT = 30
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class _BrowserInstance:
+    """一个开启了远程调试端口的 Chromium 进程"""
+
+    def __init__(self, index: int, executable_path: str, extra_args: list):
+        self.index = index
+        self.executable_path = executable_path
+        self.extra_args = extra_args
+        self.process = None
+        self.port = None
+        self.leases = 0
+
+    @property
+    def endpoint(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def launch(self):
+        self.port = _free_port()
+        user_data_dir = SERVICE_DATA_DIR / str(self.index)
+        ensure_dir_exists(user_data_dir)
+        command = [
+            self.executable_path,
+            f'--remote-debugging-port={self.port}',
+            f'--user-data-dir={user_data_dir.resolve()}',
+            '--no-first-run',
+            '--no-default-browser-check',
+            *self.extra_args,
+            'about:blank',
+        ]
+        self.process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        deadline = time.time() + STARTUP_TIMEOUT
+        while time.time() < deadline:
+            if not self.is_alive():
+                raise RuntimeError(f"浏览器进程启动后立即退出，退出码：{self.process.returncode}")
+            try:
+                if requests.get(f"{self.endpoint}/json/version", timeout=1).ok:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        self.terminate()
+        raise RuntimeError(f"等待浏览器调试端口 {self.port} 就绪超时")
+
+    def terminate(self):
+        if self.process is None:
+            return
+        try:
+            self.process.terminate()
+            self.process.wait(timeout=10)
+        except Exception:
+            self.process.kill()
+        self.process = None
+
+
+class BrowserService:
+    """
+    应用级浏览器服务：程序启动时拉起少量 Chromium 进程，供所有账号的 CrawlWorker 共用。
+
+    Playwright 的对象不能跨线程使用，所以服务租出的是浏览器的 CDP 调试地址；
+    工作线程在自己的线程中 connect_over_cdp，并新建独立的 context (Cookies 互不影响)，
+    用完后关闭 context 并归还租约，浏览器进程和磁盘缓存保持常驻。
+    """
+
+    def __init__(self, instances: int = 1, launch_config: BrowserLaunchConfig = None):
+        self.instance_count = max(1, instances)
+        self.launch_config = launch_config or BrowserLaunchConfig()
+        self.instances = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """启动所有浏览器实例，单个实例启动失败不影响其他实例"""
+        try:
+            executable_path = self.launch_config.resolve_executable()
+        except Exception as e:
+            print(f"浏览器服务找不到可用的浏览器：{e}")
+            logger.error(f"浏览器服务找不到可用的浏览器：{e}")
+            return self
+        self.instances = [_BrowserInstance(i, executable_path, self.launch_config.process_args())
+                          for i in range(self.instance_count)]
+        for instance in self.instances:
+            try:
+                instance.launch()
+                logger.info(f"浏览器服务实例 {instance.index} 已启动：{instance.endpoint}")
+            except Exception as e:
+                print(f"浏览器服务实例 {instance.index} 启动失败：{e}")
+                logger.error(f"浏览器服务实例 {instance.index} 启动失败：{e}")
+        return self
+
+    def lease(self) -> str:
+        """租用租约最少的浏览器实例，返回其 CDP 地址；进程已退出的实例会被重新拉起"""
+        with self._lock:
+            for instance in sorted(self.instances, key=lambda item: item.leases):
+                if not instance.is_alive():
+                    try:
+                        instance.launch()
+                    except Exception as e:
+                        logger.error(f"重新启动浏览器服务实例 {instance.index} 失败：{e}")
+                        continue
+                instance.leases += 1
+                return instance.endpoint
+        raise RuntimeError("浏览器服务没有可用的浏览器实例")
+
+    def release(self, endpoint: str):
+        """归还租约"""
+        with self._lock:
+            for instance in self.instances:
+                if instance.process is not None and instance.endpoint == endpoint:
+                    instance.leases = max(0, instance.leases - 1)
+                    return
+
+    def stop(self):
+        with self._lock:
+            for instance in self.instances:
+                instance.terminate()
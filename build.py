@@ -73,6 +73,8 @@ def build_app(app_type):
         '--hidden-import=PyQt5.QtGui',
         '--hidden-import=PyQt5.QtWidgets',
         '--hidden-import=requests',
+        '--hidden-import=httpx',
+        '--hidden-import=h2',
         '--hidden-import=sqlite3',
         '--hidden-import=ssl',
         '--hidden-import=cryptography',
@@ -8,6 +8,30 @@ PRODUCT_DETAIL_PAGE = 'https://www.amazon.com/gp/product/ajax/twisterDimensionSl
 
 DATETIME_PATTERN = '%Y-%m-%d %H:%M:%S'
 
+# 失败商品的重试策略：第 n 次失败后等待 RETRY_BASE_DELAY * 2^(n-1) 秒，最长 RETRY_MAX_DELAY 秒，
+# 失败达到 MAX_ATTEMPTS 次后不再重试
+RETRY_BASE_DELAY = 5 * 60
+RETRY_MAX_DELAY = 24 * 60 * 60
+MAX_ATTEMPTS = 6
+
+# 同步店小秘商品列表：默认并发页数，单页失败后的重试次数和首次重试等待秒数 (之后翻倍)
+LISTING_CONCURRENCY = 4
+LISTING_PAGE_RETRIES = 3
+LISTING_RETRY_BACKOFF = 1.0
+LISTING_PAYLOAD = {
+    'pageNo': 1,
+    'pageSize': 100,
+    'total': 0,
+    'searchType': 0,
+    'searchValue': None,
+    'shopId': -1,
+    'dxmState': 'online',
+    'dxmOfflineState': None,
+    'productStatusType': 'onSelling',
+    'sortValue': 2,
+    'sortName': 13,
+}
+
 amazon_cookies = {
         'csm-hit': 'adb:adblk_yes&t:1763970326341&tb:s-HT7FZ8V6Z70MNFKWQ1BG|1763970324959',
         'i18n-prefs':'USD',
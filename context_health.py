@@ -0,0 +1,87 @@
+import time
+from collections import deque
+
+from http_fetch import PAGE_CAPTCHA, PAGE_OK, PAGE_TIMEOUT
+
+# 健康评分的滑动窗口大小，以及开始判定前至少需要的样本数
+HEALTH_WINDOW = 20
+MIN_SAMPLES = 5
+# 超过任意一个阈值即判定为不健康
+MAX_CAPTCHA_RATE = 0.3
+MAX_TIMEOUT_RATE = 0.5
+MAX_AVG_LATENCY = 20.0
+# 隔离冷却时间 (秒)，连续熔断时翻倍，直到上限
+COOL_DOWN = 60
+MAX_COOL_DOWN = 600
+
+
+class ContextHealth:
+    """
+    单个浏览器 context (比特浏览器窗口) 的健康评分与熔断状态。
+
+    根据最近若干次页面加载的验证码率、超时率和平均耗时打分；不健康时熔断，
+    隔离一段冷却时间后由调用方重建 context。重建后若再次不健康，冷却时间翻倍；
+    恢复健康后冷却时间重置。
+    """
+
+    def __init__(self, window: int = HEALTH_WINDOW, cool_down: float = COOL_DOWN,
+                 max_cool_down: float = MAX_COOL_DOWN):
+        self.cool_down = cool_down
+        self.max_cool_down = max_cool_down
+        self._outcomes = deque(maxlen=window)  # (状态, 耗时)
+        self.trips = 0
+        self.quarantined_until = 0
+
+    def record(self, state: str, latency: float):
+        self._outcomes.append((state, latency))
+        if self.trips and len(self._outcomes) >= MIN_SAMPLES and not self.is_unhealthy():
+            # 重建后已经稳定，下次熔断从基础冷却时间重新计算
+            self.trips = 0
+
+    def _rate(self, state: str) -> float:
+        if not self._outcomes:
+            return 0
+        return sum(1 for s, _ in self._outcomes if s == state) / len(self._outcomes)
+
+    @property
+    def captcha_rate(self) -> float:
+        return self._rate(PAGE_CAPTCHA)
+
+    @property
+    def timeout_rate(self) -> float:
+        return self._rate(PAGE_TIMEOUT)
+
+    @property
+    def avg_latency(self) -> float:
+        if not self._outcomes:
+            return 0
+        return sum(latency for _, latency in self._outcomes) / len(self._outcomes)
+
+    @property
+    def score(self) -> float:
+        """0~1 的健康分，1 表示最近的加载全部成功"""
+        return self._rate(PAGE_OK) * min(1.0, MAX_AVG_LATENCY / max(self.avg_latency, 1e-6))
+
+    def is_unhealthy(self) -> bool:
+        if len(self._outcomes) < MIN_SAMPLES:
+            return False
+        return (self.captcha_rate >= MAX_CAPTCHA_RATE or self.timeout_rate >= MAX_TIMEOUT_RATE
+                or self.avg_latency >= MAX_AVG_LATENCY)
+
+    def trip(self) -> float:
+        """熔断并进入隔离，返回冷却秒数"""
+        cool_down = min(self.max_cool_down, self.cool_down * 2 ** self.trips)
+        self.trips += 1
+        self.quarantined_until = time.monotonic() + cool_down
+        return cool_down
+
+    def remaining_cool_down(self) -> float:
+        return max(0.0, self.quarantined_until - time.monotonic())
+
+    def reset_window(self):
+        """context 重建后清空旧的评分样本"""
+        self._outcomes.clear()
+
+    def describe(self) -> str:
+        return f"健康分 {self.score:.2f}，验证码率 {self.captcha_rate * 100:.0f}%，" \
+               f"超时率 {self.timeout_rate * 100:.0f}%，平均耗时 {self.avg_latency:.1f}s"
@@ -1,7 +1,8 @@
 import sqlite3
 from pathlib import Path
 from typing import List
-from constant import DATETIME_PATTERN
+from constant import DATETIME_PATTERN, MAX_ATTEMPTS
+from extractor import AmazonASINExtractor
 from bean import *
 from util import ensure_dir_exists
 
@@ -16,8 +17,10 @@ class AmazonDatabase:
     def connect(self):
         """连接数据库"""
         try:
-            self.conn = sqlite3.connect(self.db_name)
+            # 多个账号的 CrawlWorker 同时读写同一个数据库：WAL 允许读写并发，写锁冲突时等待而不是立即报错
+            self.conn = sqlite3.connect(self.db_name, timeout=30)
             self.conn.row_factory = sqlite3.Row
+            self.conn.execute('PRAGMA journal_mode=WAL')
             self.cursor = self.conn.cursor()
         except sqlite3.Error as e:
             print(f"数据库连接错误: {e}")
@@ -53,14 +56,61 @@ class AmazonDatabase:
                     create_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     owner TEXT,
+                    parent_asin TEXT,
+                    attempts INTEGER DEFAULT 0,
+                    last_error TEXT,
+                    next_retry_at TIMESTAMP,
+                    fingerprint TEXT,
+                    checked_at TIMESTAMP,
+                    change_count INTEGER DEFAULT 0,
                     FOREIGN KEY (owner) REFERENCES accounts (username)
                 );
             ''')
+            self._migrate_product_table()
+            self.cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_product_retry ON product (owner, completed, next_retry_at)
+            ''')
+            # 增量刷新按最近检查时间从旧到新挑选已完成的商品；
+            # 结果未变化时只更新 checked_at，updated_at 只在数据变化时更新
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_product_asin ON product (asin)')
+            self.cursor.execute('DROP INDEX IF EXISTS idx_product_staleness')
+            self.cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_product_checked ON product (owner, completed, checked_at)
+            ''')
+            # 各账号商品列表的同步水位：上次同步时列表中最新的商品，以及上次完整同步的时间
+            self.cursor.execute('''
+                CREATE TABLE IF NOT EXISTS listing_sync (
+                    owner TEXT PRIMARY KEY,
+                    watermark TEXT,
+                    last_sync_at TIMESTAMP,
+                    last_full_sync_at TIMESTAMP
+                );
+            ''')
 
             self.conn.commit()
         except sqlite3.Error as e:
             print(f"创建表错误: {e}")
 
+    def _migrate_product_table(self):
+        """为旧版本数据库补充新增的列"""
+        self.cursor.execute('PRAGMA table_info(product)')
+        columns = {row['name'] for row in self.cursor.fetchall()}
+        new_columns = {
+            'parent_asin': 'TEXT',
+            'attempts': 'INTEGER DEFAULT 0',
+            'last_error': 'TEXT',
+            'next_retry_at': 'TIMESTAMP',
+            'fingerprint': 'TEXT',
+            'checked_at': 'TIMESTAMP',
+            'change_count': 'INTEGER DEFAULT 0',
+        }
+        for name, definition in new_columns.items():
+            if name not in columns:
+                self.cursor.execute(f'ALTER TABLE product ADD COLUMN {name} {definition}')
+        if 'checked_at' not in columns:
+            # 已完成的商品以最后更新时间作为最近检查时间
+            self.cursor.execute('UPDATE product SET checked_at = updated_at WHERE completed = 1')
+
     def create_device_table(self):
         """创建数据表"""
         try:
@@ -195,8 +245,8 @@ class AmazonDatabase:
                 return False
         return True
 
-    def _batch_upsert_chunk(self, products: list[Product]):
-        """处理单个数据块"""
+    def _batch_upsert_chunk(self, products: list[Product], commit: bool = True):
+        """处理单个数据块，commit=False 时由调用方在同一事务中提交"""
         try:
             product_data = []
             for product in products:
@@ -213,13 +263,16 @@ class AmazonDatabase:
                     product.owner,
                     product.completed,
                     product.invalid,
+                    product.parent_asin,
+                    product.fingerprint() if product.completed else None,
                 ))
 
             self.cursor.executemany('''
             INSERT INTO product 
             (product_id, asin, url, title, price, used, shipping_from_amazon, shipping_cost, 
-             availability, owner, completed, invalid)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+             availability, owner, completed, invalid, parent_asin, fingerprint, checked_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+                    CASE WHEN ?11 = 1 THEN CURRENT_TIMESTAMP END)
             ON CONFLICT(product_id) DO UPDATE SET
                 asin = COALESCE(excluded.asin, asin),
                 url = COALESCE(excluded.url, url),
@@ -232,10 +285,19 @@ class AmazonDatabase:
                 owner = COALESCE(excluded.owner, owner),
                 completed = COALESCE(excluded.completed, completed),
                 invalid = COALESCE(excluded.invalid, invalid),
+                parent_asin = COALESCE(excluded.parent_asin, parent_asin),
+                attempts = CASE WHEN excluded.completed = 1 THEN 0 ELSE attempts END,
+                last_error = CASE WHEN excluded.completed = 1 THEN NULL ELSE last_error END,
+                next_retry_at = CASE WHEN excluded.completed = 1 THEN NULL ELSE next_retry_at END,
+                change_count = change_count + CASE WHEN excluded.fingerprint IS NOT NULL AND fingerprint IS NOT NULL
+                                                        AND excluded.fingerprint != fingerprint THEN 1 ELSE 0 END,
+                fingerprint = COALESCE(excluded.fingerprint, fingerprint),
+                checked_at = COALESCE(excluded.checked_at, checked_at),
                 updated_at = CURRENT_TIMESTAMP
             ''', product_data)
 
-            self.conn.commit()
+            if commit:
+                self.conn.commit()
             return True
 
         except sqlite3.Error as e:
@@ -243,6 +305,107 @@ class AmazonDatabase:
             self.conn.rollback()
             return False
 
+    def backfill_product_asins(self, owner: str) -> int:
+        """为同步 ASIN 之前保存的商品补充 ASIN，返回补充的商品数"""
+        try:
+            self.cursor.execute('''
+                SELECT product_id, url FROM product
+                WHERE owner = ? AND asin IS NULL AND url IS NOT NULL
+            ''', (owner,))
+            updates = []
+            for row in self.cursor.fetchall():
+                asin = AmazonASINExtractor.extract_asin(row['url'])
+                if asin:
+                    updates.append((asin.upper(), row['product_id']))
+            self.cursor.executemany('UPDATE product SET asin = ? WHERE product_id = ?', updates)
+            self.conn.commit()
+            return len(updates)
+        except sqlite3.Error as e:
+            print(f"补充商品 ASIN 错误: {e}")
+            self.conn.rollback()
+            return 0
+
+    def _get_fingerprints(self, product_ids: List[str], chunk_size=500) -> dict:
+        """批量查询已保存的结果指纹"""
+        fingerprints = {}
+        for i in range(0, len(product_ids), chunk_size):
+            chunk = product_ids[i:i + chunk_size]
+            self.cursor.execute(f'''
+                SELECT product_id, fingerprint FROM product
+                WHERE product_id IN ({','.join('?' * len(chunk))})
+            ''', chunk)
+            for row in self.cursor.fetchall():
+                fingerprints[row['product_id']] = row['fingerprint']
+        return fingerprints
+
+    def batch_save_crawl_results(self, products: List[Product]):
+        """
+        保存爬取成功的商品：指纹与已保存结果一致的只更新 checked_at，其余完整写入
+
+        :return: (结果变化的商品数, 结果未变化的商品数, 首次保存结果的商品数)，失败时返回 None
+        """
+        if not products:
+            return 0, 0, 0
+        try:
+            saved = self._get_fingerprints([product.product_id for product in products])
+        except sqlite3.Error as e:
+            print(f"查询商品指纹错误: {e}")
+            return None
+
+        unchanged, to_write = [], []
+        changed_num = 0
+        for product in products:
+            old_fingerprint = saved.get(product.product_id)
+            if old_fingerprint is not None and old_fingerprint == product.fingerprint():
+                unchanged.append(product)
+            else:
+                changed_num += old_fingerprint is not None
+                to_write.append(product)
+
+        if not self.batch_upsert_products_chunked(to_write):
+            return None
+        try:
+            self.cursor.executemany('''
+            UPDATE product SET
+                completed = 1,
+                checked_at = CURRENT_TIMESTAMP,
+                attempts = 0,
+                last_error = NULL,
+                next_retry_at = NULL,
+                parent_asin = COALESCE(?, parent_asin)
+            WHERE product_id = ?
+            ''', [(product.parent_asin, product.product_id) for product in unchanged])
+            self.conn.commit()
+        except sqlite3.Error as e:
+            print(f"更新商品检查时间错误: {e}")
+            self.conn.rollback()
+            return None
+        return changed_num, len(unchanged), len(to_write) - changed_num
+
+    def batch_schedule_retries(self, retries: list):
+        """
+        批量记录失败商品的重试计划，只更新重试相关的列
+
+        :param retries: [(product, 延迟秒数)]
+        """
+        if not retries:
+            return True
+        try:
+            self.cursor.executemany('''
+            UPDATE product SET
+                attempts = ?,
+                last_error = ?,
+                next_retry_at = datetime('now', '+' || ? || ' seconds')
+            WHERE product_id = ?
+            ''', [(product.attempts, product.last_error, int(delay), product.product_id)
+                  for product, delay in retries])
+            self.conn.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"记录重试计划错误: {e}")
+            self.conn.rollback()
+            return False
+
     def update_product_dynamic(self, product):
         """动态构建UPDATE语句，只更新有值的字段"""
         update_fields = []
@@ -315,24 +478,126 @@ class AmazonDatabase:
         except sqlite3.Error as e:
             print(f"获取爬取状态错误: {e}")
 
-    def get_product_uncompleted(self, owner: str):
-        """获取爬取状态"""
+    def get_product_uncompleted(self, owner: str, max_attempts: int = MAX_ATTEMPTS, product_ids: List[str] = None,
+                                chunk_size=500):
+        """
+        获取已到重试时间的未完成商品，失败次数少的优先
+
+        :param product_ids: 只在这些商品中查找 (如刚同步的一页商品)，None 表示该账号的全部商品
+        """
+        sql = '''
+                SELECT id, product_id, asin, url, attempts, last_error FROM product
+                where completed = 0 and owner=? and attempts < ?
+                  and (next_retry_at IS NULL OR next_retry_at <= CURRENT_TIMESTAMP)
+                  %s
+                ORDER BY attempts, next_retry_at;
+            '''
+        if product_ids is None:
+            batches = [(sql % '', (owner, max_attempts))]
+        else:
+            batches = []
+            for i in range(0, len(product_ids), chunk_size):
+                chunk = list(product_ids[i:i + chunk_size])
+                batches.append((sql % f"and product_id IN ({','.join('?' * len(chunk))})",
+                                (owner, max_attempts, *chunk)))
         try:
-            self.cursor.execute('''
-                SELECT id, product_id, url FROM product
-                where completed = 0 and owner=?;
-            ''', (owner,))
-            rows = self.cursor.fetchall()
             products = []
-            for row in rows:
-                product = Product(
-                    product_id=row['product_id'],
-                    url=row['url'],
-                )
-                products.append(product)
+            for query, params in batches:
+                self.cursor.execute(query, params)
+                for row in self.cursor.fetchall():
+                    product = Product(
+                        product_id=row['product_id'],
+                        asin=row['asin'],
+                        url=row['url'],
+                        attempts=row['attempts'] or 0,
+                        last_error=row['last_error'],
+                    )
+                    products.append(product)
             return products
         except sqlite3.Error as e:
             print(f"获取爬取状态错误: {e}")
+            return []
+
+    def get_known_results(self, product_ids: List[str], chunk_size=500) -> dict:
+        """
+        查询已有完整爬取结果 (有父 ASIN、发货方已知、非二手、未失效) 的商品，
+        变体接口只更新价格和库存，其余字段沿用这里的结果
+
+        :return: {product_id: Product}
+        """
+        results = {}
+        try:
+            for i in range(0, len(product_ids), chunk_size):
+                chunk = [str(product_id) for product_id in product_ids[i:i + chunk_size]]
+                self.cursor.execute(f'''
+                    SELECT product_id, asin, parent_asin, shipping_from_amazon, shipping_cost FROM product
+                    WHERE product_id IN ({','.join('?' * len(chunk))})
+                      AND (completed = 1 OR fingerprint IS NOT NULL)
+                      AND parent_asin IS NOT NULL AND shipping_from_amazon IS NOT NULL
+                      AND used = 0 AND invalid = 0
+                ''', chunk)
+                for row in self.cursor.fetchall():
+                    results[row['product_id']] = Product(
+                        product_id=row['product_id'],
+                        asin=row['asin'],
+                        parent_asin=row['parent_asin'],
+                        used=False,
+                        shipping_from_amazon=row['shipping_from_amazon'] == '1',
+                        shipping_cost=row['shipping_cost'],
+                    )
+            return results
+        except sqlite3.Error as e:
+            print(f"查询已有爬取结果错误: {e}")
+            return {}
+
+    def get_product_stale(self, owner: str, max_age_hours: float, limit: int,
+                          max_attempts: int = MAX_ATTEMPTS) -> List[Product]:
+        """
+        获取超过 max_age_hours 小时未检查的已完成商品，最久未检查的优先，最多 limit 个。
+        结果变化过的商品 (价格、库存波动) 只需一半时间即视为过期。
+        刷新失败的商品同样遵循重试计划。
+        """
+        try:
+            self.cursor.execute('''
+                SELECT product_id, asin, url, attempts, last_error FROM product
+                where owner = ? and completed = 1 and checked_at <= datetime('now', ?)
+                  and (checked_at <= datetime('now', ?) OR change_count > 0)
+                  and invalid = 0 and attempts < ?
+                  and (next_retry_at IS NULL OR next_retry_at <= CURRENT_TIMESTAMP)
+                ORDER BY checked_at
+                LIMIT ?;
+            ''', (owner, f'-{max_age_hours / 2} hours', f'-{float(max_age_hours)} hours', max_attempts, limit))
+            return [Product(
+                product_id=row['product_id'],
+                asin=row['asin'],
+                url=row['url'],
+                attempts=row['attempts'] or 0,
+                last_error=row['last_error'],
+            ) for row in self.cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"获取待刷新商品错误: {e}")
+            return []
+
+    def count_product_deferred(self, owner: str, max_attempts: int = MAX_ATTEMPTS):
+        """
+        统计未完成但本次不会爬取的商品
+
+        :return: (未到重试时间的商品数, 超过最大重试次数的商品数)
+        """
+        try:
+            self.cursor.execute('''
+                SELECT
+                    SUM(CASE WHEN attempts < ? THEN 1 ELSE 0 END) AS waiting,
+                    SUM(CASE WHEN attempts >= ? THEN 1 ELSE 0 END) AS exhausted
+                FROM product
+                where completed = 0 and owner=?
+                  and (attempts >= ? OR next_retry_at > CURRENT_TIMESTAMP);
+            ''', (max_attempts, max_attempts, owner, max_attempts))
+            row = self.cursor.fetchone()
+            return row['waiting'] or 0, row['exhausted'] or 0
+        except sqlite3.Error as e:
+            print(f"统计重试状态错误: {e}")
+            return 0, 0
 
     def get_device_by_name(self, device_name: str):
         """获取爬取状态"""
@@ -403,6 +668,121 @@ class AmazonDatabase:
             print(f"获取所有设备信息错误: {e}")
             return []
 
+    def get_listing_sync(self, owner: str):
+        """
+        获取账号的列表同步水位
+
+        :return: (水位商品编号, 距上次完整同步的小时数)；从未同步过时返回 (None, None)
+        """
+        try:
+            self.cursor.execute('''
+                SELECT watermark, (julianday('now') - julianday(last_full_sync_at)) * 24 AS full_sync_age
+                FROM listing_sync WHERE owner = ?
+            ''', (owner,))
+            row = self.cursor.fetchone()
+            if row is None:
+                return None, None
+            return row['watermark'], row['full_sync_age']
+        except sqlite3.Error as e:
+            print(f"获取列表同步水位错误: {e}")
+            return None, None
+
+    def save_listing_sync(self, owner: str, watermark: str, full: bool):
+        """记录本次同步的水位，完整同步时同时更新完整同步时间"""
+        try:
+            self.cursor.execute('''
+                INSERT INTO listing_sync (owner, watermark, last_sync_at, last_full_sync_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP, CASE WHEN ? THEN CURRENT_TIMESTAMP END)
+                ON CONFLICT(owner) DO UPDATE SET
+                    watermark = excluded.watermark,
+                    last_sync_at = excluded.last_sync_at,
+                    last_full_sync_at = COALESCE(excluded.last_full_sync_at, last_full_sync_at)
+            ''', (owner, watermark, full))
+            self.conn.commit()
+        except sqlite3.Error as e:
+            print(f"保存列表同步水位错误: {e}")
+
+    def begin_listing_diff(self):
+        """
+        开始一次列表同步：同步到的商品编号逐页写入当前连接的临时表，
+        新商品和失效商品都通过与 product 表的反连接在 SQLite 中计算
+        """
+        try:
+            self.cursor.execute('CREATE TEMP TABLE IF NOT EXISTS listing_seen (product_id TEXT PRIMARY KEY)')
+            self.cursor.execute('CREATE TEMP TABLE IF NOT EXISTS listing_page (product_id TEXT PRIMARY KEY)')
+            self.cursor.execute('DELETE FROM temp.listing_seen')
+            self.conn.commit()
+        except sqlite3.Error as e:
+            print(f"创建列表同步临时表错误: {e}")
+
+    def sync_listing_page(self, products: List[Product]) -> List[Product]:
+        """
+        记录同步到的一页商品，并在同一事务中插入其中的新商品
+
+        :return: 本页的新商品
+        """
+        by_id = {str(p.product_id): p for p in products}
+        try:
+            self.cursor.execute('DELETE FROM temp.listing_page')
+            self.cursor.executemany('INSERT OR IGNORE INTO temp.listing_page (product_id) VALUES (?)',
+                                    [(pid,) for pid in by_id])
+            self.cursor.execute('''
+                INSERT OR IGNORE INTO temp.listing_seen (product_id) SELECT product_id FROM temp.listing_page
+            ''')
+            self.cursor.execute('''
+                SELECT lp.product_id FROM temp.listing_page lp
+                WHERE NOT EXISTS (SELECT 1 FROM product WHERE product.product_id = lp.product_id)
+            ''')
+            new_products = [by_id[row['product_id']] for row in self.cursor.fetchall()]
+            if new_products and not self._batch_upsert_chunk(new_products, commit=False):
+                return []
+            self.conn.commit()
+            return new_products
+        except sqlite3.Error as e:
+            print(f"同步商品列表页错误: {e}")
+            self.conn.rollback()
+            return []
+
+    def delete_unseen_products(self, owner: str):
+        """
+        在一个事务中删除本次列表同步没有见到的商品 (已下架)
+
+        :return: (删除的商品数, 其中已完成的商品数)
+        """
+        unseen = '''
+            FROM product WHERE owner = ?
+              AND NOT EXISTS (SELECT 1 FROM temp.listing_seen s WHERE s.product_id = product.product_id)
+        '''
+        try:
+            self.cursor.execute(f'SELECT COUNT(*), COALESCE(SUM(completed = 1), 0) {unseen}', (owner,))
+            deleted, deleted_completed = self.cursor.fetchone()
+            if deleted:
+                self.cursor.execute(f'DELETE {unseen}', (owner,))
+            self.conn.commit()
+            return deleted, deleted_completed
+        except sqlite3.Error as e:
+            print(f"删除失效商品错误: {e}")
+            self.conn.rollback()
+            return 0, 0
+
+    def count_products(self, owner: str) -> int:
+        """统计账号下的商品数"""
+        try:
+            self.cursor.execute('SELECT COUNT(*) FROM product WHERE owner = ?', (owner,))
+            return self.cursor.fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"统计商品数错误: {e}")
+            return 0
+
+    def count_product_completed(self, owner: str) -> int:
+        """统计账号下已完成的商品数"""
+        try:
+            self.cursor.execute('SELECT COUNT(*) FROM product WHERE owner = ? AND completed = 1', (owner,))
+            return self.cursor.fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"统计已完成商品错误: {e}")
+            return 0
+
     def get_all_products(self, owner: str) -> List[Product]:
         """获取爬取状态"""
         try:
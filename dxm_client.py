@@ -0,0 +1,134 @@
+import asyncio
+import concurrent.futures
+import threading
+
+import requests
+
+from logger import setup_concurrent_logging
+
+try:
+    import httpx
+except ImportError:  # 未安装 httpx 时退回带超时的 requests
+    httpx = None
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+logger = setup_concurrent_logging()
+
+# 店小秘接口的连接/读取超时 (秒)
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+# 单个账号同时进行的请求数
+DEFAULT_CONCURRENCY = 4
+# 空闲长连接的保持时间 (秒)
+KEEPALIVE_EXPIRY = 60
+
+
+class DxmResponse:
+    """与 requests.Response 用法一致的最小响应对象"""
+
+    def __init__(self, status_code: int, content: bytes, text: str):
+        self.status_code = status_code
+        self.content = content
+        self.text = text
+
+
+class _EventLoopThread:
+    """所有账号共用的后台事件循环，店小秘的请求都在这里并发执行"""
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='dxm-client-loop', daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def get(cls) -> '_EventLoopThread':
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def run(self, coro, timeout: float):
+        """在事件循环中执行协程并阻塞等待结果，超过 timeout 秒时取消"""
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+
+class DxmClient:
+    """
+    店小秘接口的异步客户端：基于 httpx (可用时启用 HTTP/2 和长连接)，
+    所有账号的请求在同一个后台事件循环中执行，每个账号的并发数由信号量限制。
+
+    Cookies 与 requests 会话共用同一个 CookieJar，登录、Cookies 持久化等逻辑不需要改动。
+    未安装 httpx 时直接使用 requests 会话，同样带有连接/读取超时。
+    """
+
+    def __init__(self, session: requests.Session, concurrency: int = DEFAULT_CONCURRENCY,
+                 connect_timeout: float = CONNECT_TIMEOUT, read_timeout: float = READ_TIMEOUT):
+        self.session = session
+        self.concurrency = max(1, concurrency)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._client = None
+        self._semaphore = None
+        self._loop_thread = _EventLoopThread.get() if httpx is not None else None
+
+    @property
+    def total_timeout(self) -> float:
+        """单个请求 (含排队等待并发名额) 的最长等待时间，防止工作线程被挂起的请求卡住"""
+        return self.connect_timeout + self.read_timeout * 2
+
+    def _ensure_client(self):
+        """在事件循环线程中创建 httpx 客户端"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                cookies=self.session.cookies,
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency,
+                                    keepalive_expiry=KEEPALIVE_EXPIRY),
+                follow_redirects=True,
+            )
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._client
+
+    async def request_async(self, method: str, url: str, data=None, headers=None) -> DxmResponse:
+        client = self._ensure_client()
+        async with self._semaphore:
+            resp = await client.request(method, url, data=data, headers=headers)
+        return DxmResponse(resp.status_code, resp.content, resp.text)
+
+    def request(self, method: str, url: str, data=None, headers=None) -> DxmResponse:
+        if isinstance(data, dict):
+            # 与 requests 一致，值为 None 的表单字段不发送
+            data = {key: value for key, value in data.items() if value is not None}
+        if self._loop_thread is None:
+            resp = self.session.request(method, url, data=data, headers=headers,
+                                        timeout=(self.connect_timeout, self.read_timeout))
+            return DxmResponse(resp.status_code, resp.content, resp.text)
+        return self._loop_thread.run(self.request_async(method, url, data=data, headers=headers), self.total_timeout)
+
+    def get(self, url: str, headers=None) -> DxmResponse:
+        return self.request('GET', url, headers=headers)
+
+    def post(self, url: str, data=None, headers=None) -> DxmResponse:
+        return self.request('POST', url, data=data, headers=headers)
+
+    def close(self):
+        if self._client is None or self._loop_thread is None:
+            return
+        try:
+            self._loop_thread.run(self._client.aclose(), self.connect_timeout)
+        except Exception as e:
+            logger.warning(f"关闭店小秘客户端失败：{e}")
+        self._client = None
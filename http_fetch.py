@@ -0,0 +1,101 @@
+import re
+
+import requests
+
+from bean import Product
+from logger import setup_concurrent_logging
+
+logger = setup_concurrent_logging()
+
+# 抓取模式：browser 只用浏览器；tiered 先用 requests 获取，必要时再升级到浏览器
+FETCH_MODE_BROWSER = 'browser'
+FETCH_MODE_TIERED = 'tiered'
+
+# 页面分类结果
+PAGE_OK = 'ok'
+PAGE_NOT_FOUND = 'not_found'
+PAGE_CAPTCHA = 'captcha'
+PAGE_JS_SHELL = 'js_shell'
+PAGE_NO_BUYBOX = 'no_buybox'
+PAGE_HTTP_ERROR = 'http_error'
+PAGE_UNKNOWN = 'unknown'
+PAGE_TIMEOUT = 'timeout'
+
+# 与浏览器上下文保持一致的请求头，避免 requests 默认 UA 直接触发验证码
+AMAZON_HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/142.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Upgrade-Insecure-Requests': '1',
+}
+
+CAPTCHA_MARKERS = (
+    "Type the characters",
+    "Sorry, we just need to make sure you're not a robot",
+    "/errors/validateCaptcha",
+)
+NOT_FOUND_MARKERS = (
+    "Sorry! We couldn't find that page",
+    "The requested URL was not found",
+)
+
+# 商品详情页主体，缺失说明拿到的是需要 JS 渲染的壳页面
+_PRODUCT_SHELL_RE = re.compile(r'id=["\'](?:dp|productTitle)["\']')
+# 解析逻辑依赖的购买区标记，任意一个存在即可在服务端 HTML 上直接解析
+_BUYBOX_RE = re.compile(
+    r'id=["\'](?:buybox|newAccordionRow_[^"\']*|corePrice_feature_div|outOfStock|usedOnlyBuybox'
+    r'|partialStateBuybox|fod-cx-message-with-learn-more)["\']')
+
+
+def classify_product_html(status_code: int, html: str) -> str:
+    """根据状态码和页面内容判断 HTTP 获取的商品页能否直接解析"""
+    if status_code == 404:
+        return PAGE_NOT_FOUND
+    if any(marker in html for marker in CAPTCHA_MARKERS):
+        return PAGE_CAPTCHA
+    if status_code != 200:
+        return PAGE_HTTP_ERROR
+    if not _PRODUCT_SHELL_RE.search(html):
+        return PAGE_JS_SHELL
+    if not _BUYBOX_RE.search(html):
+        return PAGE_NO_BUYBOX
+    return PAGE_OK
+
+
+def is_throttled(status_code: int, state: str) -> bool:
+    """验证码页面或 503 都说明请求过快，需要降速"""
+    return state == PAGE_CAPTCHA or status_code == 503
+
+
+def http_fetch_product(session: requests.Session, product: Product, timeout=10, pacer=None):
+    """
+    第一层：直接用 requests 获取商品页。
+
+    :param pacer: 可选的 AdaptivePacer，遇到验证码/503 时降速
+    :return: 可直接解析的页面源码；返回 None 时，如果 product.completed 为 True
+             说明已确认失效，否则需要升级到浏览器获取
+    """
+    url = product.url
+    try:
+        resp = session.get(url, timeout=timeout)
+    except Exception as e:
+        logger.debug(f'{url} HTTP 获取失败，升级到浏览器：{e}')
+        return None
+
+    state = classify_product_html(resp.status_code, resp.text)
+    if pacer is not None:
+        if is_throttled(resp.status_code, state):
+            pacer.on_throttle()
+        elif state == PAGE_OK:
+            pacer.on_success()
+    if state == PAGE_OK:
+        return resp.text
+    if state == PAGE_NOT_FOUND:
+        print(f'{url} 链接失效，疑似 404 页面。')
+        logger.warning(f'{url} 链接失效，疑似 404 页面。')
+        product.completed = True
+        product.invalid = True
+        return None
+    logger.debug(f'{url} HTTP 页面无法直接解析({state})，升级到浏览器')
+    return None
@@ -0,0 +1,150 @@
+import json
+import os
+import platform
+import shutil
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional
+
+from constant import CACHE_DIR
+from logger import setup_concurrent_logging
+
+logger = setup_concurrent_logging()
+
+# 默认的浏览器启动配置文件，命令行参数优先于配置文件
+LAUNCH_CONFIG_FILE = Path(CACHE_DIR) / 'browser_config.json'
+
+BROWSER_ARGS = [
+    '--disable-blink-features=AutomationControlled',
+    '--no-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-web-security',
+    '--disable-features=IsolateOrigins,site-per-process'
+]
+# 无界面服务器上额外使用的参数：关闭 GPU、扩展和后台服务，降低单个浏览器的内存和 CPU 占用
+SERVER_ARGS = [
+    '--disable-gpu',
+    '--disable-extensions',
+    '--disable-background-networking',
+    '--disable-background-timer-throttling',
+    '--disable-backgrounding-occluded-windows',
+    '--disable-renderer-backgrounding',
+    '--disable-breakpad',
+    '--disable-component-update',
+    '--disable-sync',
+    '--metrics-recording-only',
+    '--mute-audio',
+    '--no-first-run',
+    '--hide-scrollbars',
+]
+
+# 各系统下 Chrome 的常见安装位置
+CHROME_PATHS = {
+    'Windows': [
+        r"C:\Program Files\Google\Chrome\Application\chrome.exe",
+        r"C:\Program Files (x86)\Google\Chrome\Application\chrome.exe",
+    ],
+    'Darwin': [
+        "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome",
+    ],
+    'Linux': [
+        "/usr/bin/google-chrome",
+        "/usr/bin/google-chrome-stable",
+        "/usr/bin/chromium",
+        "/usr/bin/chromium-browser",
+    ],
+}
+
+
+def find_chrome() -> Optional[str]:
+    """查找本机安装的 Chrome/Chromium，找不到时返回 None"""
+    for path in CHROME_PATHS.get(platform.system(), []):
+        if os.path.exists(path):
+            return path
+    for name in ('google-chrome', 'google-chrome-stable', 'chromium', 'chromium-browser', 'chrome'):
+        path = shutil.which(name)
+        if path:
+            return path
+    return None
+
+
+@dataclass
+class BrowserLaunchConfig:
+    """
+    浏览器启动配置。
+
+    浏览器的选择顺序：executable_path 指定的可执行文件 > channel 指定的 Chrome 渠道 (chrome、chrome-beta、msedge 等)
+    > 本机安装的 Chrome > Playwright 自带的 Chromium。
+    """
+    headless: bool = False
+    channel: Optional[str] = None
+    executable_path: Optional[str] = None
+    extra_args: List[str] = field(default_factory=list)
+
+    @classmethod
+    def load(cls, path=LAUNCH_CONFIG_FILE, headless: bool = None, channel: str = None, executable_path: str = None):
+        """
+        读取 JSON 配置文件 ({"headless": true, "channel": "chrome", "executable_path": "...", "extra_args": []})，
+        再用命令行参数覆盖；文件不存在时使用默认值
+        """
+        config = cls()
+        path = Path(path) if path else None
+        if path is not None and path.exists():
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                config = cls(headless=bool(data.get('headless', False)), channel=data.get('channel') or None,
+                             executable_path=data.get('executable_path') or None,
+                             extra_args=list(data.get('extra_args') or []))
+            except (OSError, ValueError) as e:
+                print(f"读取浏览器配置文件 {path} 失败：{e}")
+                logger.error(f"读取浏览器配置文件 {path} 失败：{e}")
+        if headless is not None:
+            config.headless = headless
+        if channel:
+            config.channel = channel
+            config.executable_path = None
+        if executable_path:
+            config.executable_path = executable_path
+        return config
+
+    @property
+    def args(self) -> List[str]:
+        args = BROWSER_ARGS + (SERVER_ARGS if self.headless else [])
+        return args + [arg for arg in self.extra_args if arg not in args]
+
+    def launch_options(self) -> dict:
+        """playwright chromium.launch 的参数"""
+        options = {'headless': self.headless, 'args': self.args}
+        if self.executable_path:
+            options['executable_path'] = self.executable_path
+        elif self.channel:
+            options['channel'] = self.channel
+        else:
+            # 未指定时优先使用本机 Chrome，没有安装则使用 Playwright 自带的 Chromium
+            chrome = find_chrome()
+            if chrome:
+                options['executable_path'] = chrome
+        return options
+
+    def resolve_executable(self) -> str:
+        """
+        浏览器服务直接启动浏览器进程，需要可执行文件路径 (channel 只对 Playwright 启动生效)：
+        executable_path > 本机 Chrome > Playwright 自带的 Chromium
+        """
+        if self.executable_path:
+            return self.executable_path
+        chrome = find_chrome()
+        if chrome:
+            return chrome
+        from playwright.sync_api import sync_playwright
+        with sync_playwright() as p:
+            return p.chromium.executable_path
+
+    def process_args(self) -> List[str]:
+        """浏览器服务直接启动浏览器进程时使用的参数"""
+        return (['--headless=new'] if self.headless else []) + self.args
+
+    def describe(self) -> str:
+        browser = self.executable_path or (f"渠道 {self.channel}" if self.channel else (find_chrome() or "自带 Chromium"))
+        return f"{'无界面' if self.headless else '有界面'}，浏览器 {browser}"
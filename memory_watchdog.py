@@ -0,0 +1,127 @@
+from typing import Optional
+from urllib.parse import urlparse
+
+from logger import setup_concurrent_logging
+
+try:
+    import psutil
+except ImportError:  # 未安装 psutil 时只按导航次数回收
+    psutil = None
+
+logger = setup_concurrent_logging()
+
+# 同一个 context 导航多少次后重建，0 表示不按次数回收
+RECYCLE_AFTER_NAVIGATIONS = 300
+# 浏览器进程总内存 (MB) 超过该值时重建 context，0 表示不检查内存
+RSS_LIMIT_MB = 3072
+# 每导航多少次采样一次内存
+SAMPLE_EVERY_NAVIGATIONS = 20
+
+
+def playwright_driver_pid(playwright) -> Optional[int]:
+    """
+    Playwright 驱动进程的 PID，自行启动的浏览器是它的子进程；取不到时返回 None。
+    每个 agent 有自己的 Playwright 实例，以它为根的进程树只包含该 agent 的浏览器
+    """
+    try:
+        return playwright._impl_obj._connection._transport._proc.pid
+    except AttributeError:
+        return None
+
+
+def debugging_port_pid(cdp_endpoint: str) -> Optional[int]:
+    """按调试端口查找 CDP 连接的浏览器主进程 (比特浏览器窗口、浏览器服务)，找不到时返回 None"""
+    if psutil is None:
+        return None
+    try:
+        port = urlparse(cdp_endpoint).port
+    except ValueError:
+        return None
+    if not port:
+        return None
+    switch = f'--remote-debugging-port={port}'
+    for process in psutil.process_iter(['cmdline']):
+        cmdline = process.info.get('cmdline') or []
+        # 渲染等子进程带有 --type 参数，主进程没有
+        if switch in cmdline and not any(arg.startswith('--type=') for arg in cmdline):
+            return process.pid
+    return None
+
+
+def browser_rss_mb(pid: int) -> Optional[float]:
+    """
+    以 pid 为根的进程树 (浏览器主进程及其渲染、GPU 等子进程) 的常驻内存之和 (MB)，
+    未安装 psutil 或进程已退出时返回 None
+    """
+    if psutil is None or pid is None:
+        return None
+    try:
+        root = psutil.Process(pid)
+        processes = [root] + root.children(recursive=True)
+    except psutil.Error:
+        return None
+    total = 0
+    for process in processes:
+        try:
+            total += process.memory_info().rss
+        except psutil.Error:
+            # 采样期间退出的进程
+            continue
+    return total / 1024 / 1024
+
+
+class MemoryWatchdog:
+    """
+    单个 context 的回收判断：导航次数达到上限，或采样到的浏览器内存超过阈值时，
+    给出回收原因，由调用方在没有进行中的导航时重建 context。
+
+    内存只统计 agent 自己的浏览器进程树 (由 track 指定)，不包含其他账号的浏览器和解析进程；
+    多个 agent 共用浏览器服务中的同一个浏览器时，采样的是该浏览器的内存。
+    """
+
+    def __init__(self, max_navigations: int = RECYCLE_AFTER_NAVIGATIONS, rss_limit_mb: float = RSS_LIMIT_MB,
+                 sample_every: int = SAMPLE_EVERY_NAVIGATIONS):
+        self.max_navigations = max_navigations
+        self.rss_limit_mb = rss_limit_mb if psutil is not None else 0
+        self.sample_every = max(1, sample_every)
+        self.navigations = 0
+        self.last_rss_mb = None
+        self._reason = None
+        self._pid = None
+        self._cdp_endpoint = None
+        if rss_limit_mb and psutil is None:
+            logger.info("未安装 psutil，只按导航次数回收浏览器 context")
+
+    def track(self, pid: int = None, cdp_endpoint: str = None):
+        """
+        指定要采样的浏览器：自行启动的浏览器传入 Playwright 驱动进程的 pid，
+        CDP 连接的浏览器传入调试地址，首次采样时按端口查找浏览器进程
+        """
+        self._pid = pid
+        self._cdp_endpoint = cdp_endpoint
+
+    def _browser_pid(self) -> Optional[int]:
+        if self._pid is not None and psutil.pid_exists(self._pid):
+            return self._pid
+        self._pid = debugging_port_pid(self._cdp_endpoint) if self._cdp_endpoint else None
+        return self._pid
+
+    def on_navigation(self):
+        self.navigations += 1
+        if self._reason is not None:
+            return
+        if self.max_navigations and self.navigations >= self.max_navigations:
+            self._reason = f"已导航 {self.navigations} 次"
+        elif self.rss_limit_mb and self.navigations % self.sample_every == 0:
+            self.last_rss_mb = browser_rss_mb(self._browser_pid())
+            if self.last_rss_mb is not None and self.last_rss_mb >= self.rss_limit_mb:
+                self._reason = f"浏览器内存 {self.last_rss_mb:.0f} MB 超过 {self.rss_limit_mb:.0f} MB"
+
+    def recycle_reason(self) -> Optional[str]:
+        """需要回收时返回原因，否则返回 None"""
+        return self._reason
+
+    def reset(self):
+        """context 重建后重新计数"""
+        self.navigations = 0
+        self._reason = None
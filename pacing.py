@@ -0,0 +1,90 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+
+class AdaptivePacer:
+    """
+    单个 agent (同一出口 IP) 的请求节奏控制：令牌桶限速，
+    遇到验证码/503 时速率乘性下降，成功时加性恢复 (AIMD)。
+    """
+
+    def __init__(self, rate: float = 2.0, min_rate: float = 0.05, max_rate: float = 5.0,
+                 increase: float = 0.05, decrease: float = 0.5, burst: float = 1.0, window: int = 100):
+        """
+        :param rate: 初始速率 (次/秒)
+        :param min_rate: 速率下限
+        :param max_rate: 速率上限
+        :param increase: 每次成功增加的速率
+        :param decrease: 每次被限流时速率乘以的系数
+        :param burst: 令牌桶容量
+        :param window: 统计验证码率的最近结果数
+        """
+        self.max_rate = max(max_rate, min_rate)
+        self.min_rate = min_rate
+        self.rate = min(max(rate, min_rate), self.max_rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.burst = burst
+        self._tokens = burst
+        self._last_refill = time.monotonic()
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def _reserve(self) -> float:
+        """尝试取一个令牌，成功返回 0，否则返回还需等待的秒数"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def try_acquire(self) -> bool:
+        """非阻塞地取一个令牌"""
+        return self._reserve() == 0
+
+    def acquire(self):
+        """阻塞直到取得令牌"""
+        while True:
+            delay = self._reserve()
+            if delay == 0:
+                return
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        """acquire 的协程版本"""
+        while True:
+            delay = self._reserve()
+            if delay == 0:
+                return
+            await asyncio.sleep(delay)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+            self._outcomes.append(False)
+
+    def on_throttle(self):
+        """遇到验证码或 503：降低速率并清空令牌，避免立刻发出下一个请求"""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._tokens = 0
+            self._last_refill = time.monotonic()
+            self._outcomes.append(True)
+
+    @property
+    def captcha_rate(self) -> float:
+        with self._lock:
+            if not self._outcomes:
+                return 0
+            return sum(self._outcomes) / len(self._outcomes)
+
+    def describe(self) -> str:
+        return f"速率 {self.rate:.2f} 次/秒，最近验证码率 {self.captcha_rate * 100:.1f}%"
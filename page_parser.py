@@ -0,0 +1,244 @@
+import re
+
+import soupsieve
+from bs4 import BeautifulSoup
+
+from bean import Product
+from logger import setup_concurrent_logging
+
+logger = setup_concurrent_logging()
+
+# 商品页 twister 数据中的父 ASIN
+_PARENT_ASIN_RE = re.compile(r'"parentAsin"\s*:\s*"([A-Z0-9]{10})"')
+_PARENT_ASIN_BYTES_RE = re.compile(_PARENT_ASIN_RE.pattern.encode())
+
+# 解析逻辑用到的全部 CSS 选择器，在导入时一次性编译，避免每个商品重复编译
+SELECTORS = (
+    '#fod-cx-message-with-learn-more > span:nth-child(1)',
+    '#outOfStock',
+    '#usedOnlyBuybox',
+    'div#usedAccordionRow',
+    'div[id^="newAccordionRow_"]',
+    'div#partialStateBuybox',
+    '#buybox',
+    '#availability > span',
+    '#corePrice_feature_div',
+    'span.a-offscreen',
+    '#mir-layout-DELIVERY_BLOCK-slot-PRIMARY_DELIVERY_MESSAGE_LARGE > span',
+    '#mir-layout-DELIVERY_BLOCK-slot-NO_PROMISE_UPSELL_MESSAGE > a',
+    '#mir-layout-DELIVERY_BLOCK-slot-NO_PROMISE_UPSELL_MESSAGE',
+    '#fulfillerInfoFeature_feature_div > div.offer-display-feature-text.a-size-small > div.offer-display-feature-text.a-spacing-none.odf-truncation-popover > span',
+    '#sellerProfileTriggerId',
+    '#merchantInfoFeature_feature_div > div.offer-display-feature-text.a-size-small > div.offer-display-feature-text.a-spacing-none.odf-truncation-popover > span',
+    '#merchantInfoFeature_feature_div > div.offer-display-feature-text.a-size-small > div.offer-display-feature-text.a-spacing-none.odf-truncation-popover.aok-inline-block',
+    '#selectQuantity',
+    '#corePrice_feature_div > div > div > div > div > span.a-price.a-text-normal.aok-align-center.reinventPriceAccordionT2 > span.a-offscreen',
+    '#mir-layout-DELIVERY_BLOCK-slot-PRIMARY_DELIVERY_MESSAGE_MEDIUM',
+    '#sfsb_accordion_head > div:nth-child(1) > div > span:nth-child(2)',
+    '#sfsb_accordion_head > div:nth-child(2) > div > span:nth-child(2)',
+)
+_COMPILED_SELECTORS = {selector: soupsieve.compile(selector) for selector in SELECTORS}
+
+
+def _select_one(node, selector: str):
+    """与 BeautifulSoup 的 select_one 一致：返回第一个匹配的后代元素，没有时返回 None"""
+    return _COMPILED_SELECTORS[selector].select_one(node)
+
+
+def shipping_from_amazon(ships_from, sold_by):
+    return 'amazon' in ships_from.lower() or 'amazon' in sold_by.lower()
+
+
+def extract_price(price_text):
+    logger.debug(f"price_span 类型: {type(price_text)}, 值: {price_text}")
+    match = re.search(r'\d{1,3}(?:,\d{3})*(?:\.\d+)?', price_text)
+    if match:
+        price = match.group()
+        return float(price.replace(',', ''))
+    else:
+        return 0
+
+
+def extract_parent_asin(main_page_source):
+    """从商品页源代码中取出父 ASIN，没有变体的商品返回 None"""
+    regex = _PARENT_ASIN_BYTES_RE if isinstance(main_page_source, bytes) else _PARENT_ASIN_RE
+    match = regex.search(main_page_source)
+    if match is None:
+        return None
+    parent_asin = match.group(1)
+    return parent_asin.decode() if isinstance(parent_asin, bytes) else parent_asin
+
+
+def parse_product_html(product: Product, main_page_source) -> Product:
+    """使用 BeautifulSoup 解析商品页 HTML 源代码，把价格、库存、运费、发货方等信息写入 product"""
+    url = product.url
+    if not isinstance(main_page_source, (str, bytes)):
+        logger.error(f"resp.text 返回了意外的类型: {main_page_source}")
+        return product
+    product.parent_asin = extract_parent_asin(main_page_source) or product.parent_asin
+    main_soup = BeautifulSoup(main_page_source, 'html.parser')
+
+    # 无商品信息检查
+    learn_more_span = _select_one(main_soup, '#fod-cx-message-with-learn-more > span:nth-child(1)')
+    out_of_stock_div = _select_one(main_soup, '#outOfStock')
+    if learn_more_span or out_of_stock_div:
+        print(f'{url} 无商品信息')
+        logger.warning(f'{url} 无商品信息')
+        product.completed = True
+        product.invalid = True
+        return product
+
+    used_only_buy_box = _select_one(main_soup, '#usedOnlyBuybox')
+    if used_only_buy_box:
+        print(f'{url} 是二手商品')
+        product.used = True
+        product.completed = True
+        return product
+    used_div = _select_one(main_soup, 'div#usedAccordionRow')
+    if used_div:
+        if _select_one(main_soup, 'div[id^="newAccordionRow_"]') is None:
+            product.used = True
+            product.completed = True
+            return product
+    partial_state_box = _select_one(main_soup, 'div#partialStateBuybox')
+    if partial_state_box:
+        product.completed = True
+        product.invalid = True
+        return product
+    new_product_div = _select_one(main_soup, 'div[id^="newAccordionRow_"]')
+    shipping_from = ''
+    sold_by = ''
+    availability = False
+    if new_product_div is None:
+        buy_box_div = _select_one(main_soup, '#buybox')
+        if buy_box_div:
+            availability_span = _select_one(buy_box_div, '#availability > span')
+        else:
+            availability_span = None
+        if availability_span is None:
+            product.availability = False
+            product.completed = True
+            # 有价格显示考虑是有货的
+            core_price_feature_div = _select_one(buy_box_div, '#corePrice_feature_div')
+            if core_price_feature_div:
+                availability = True
+        else:
+            availability_text = availability_span.text.lower()
+            availability = 'in stock' in availability_text or 'available to ship' in availability_text
+        if availability:
+            core_price_feature_div = _select_one(buy_box_div, '#corePrice_feature_div')
+            if core_price_feature_div:
+                price_span = _select_one(core_price_feature_div, 'span.a-offscreen')
+            else:
+                price_span = None
+            if price_span:
+                product.price = extract_price(price_span.text)
+            delivery_tag = _select_one(buy_box_div,
+                '#mir-layout-DELIVERY_BLOCK-slot-PRIMARY_DELIVERY_MESSAGE_LARGE > span')
+            if delivery_tag is None:
+                delivery_tag = _select_one(buy_box_div,
+                    '#mir-layout-DELIVERY_BLOCK-slot-NO_PROMISE_UPSELL_MESSAGE > a')
+            if delivery_tag:
+                product.shipping_cost = delivery_tag.text.strip().split(' ')[0]
+            else:
+                delivery_tag = _select_one(buy_box_div,
+                    '#mir-layout-DELIVERY_BLOCK-slot-NO_PROMISE_UPSELL_MESSAGE')
+                if delivery_tag:
+                    product.shipping_cost = delivery_tag.text.strip().split(' ')[0]
+                else:
+                    print(f'{url} 无法获取运费信息')
+            ships_from_span = _select_one(buy_box_div,
+                '#fulfillerInfoFeature_feature_div > div.offer-display-feature-text.a-size-small > div.offer-display-feature-text.a-spacing-none.odf-truncation-popover > span')
+            if ships_from_span:
+                shipping_from = ships_from_span.text.strip()
+            else:
+                ships_from_new_span = _select_one(main_soup, '#sellerProfileTriggerId')
+                if ships_from_new_span:
+                    shipping_from = ships_from_new_span.text.strip()
+                else:
+                    ships_from_span = _select_one(main_soup,
+                        '#merchantInfoFeature_feature_div > div.offer-display-feature-text.a-size-small > div.offer-display-feature-text.a-spacing-none.odf-truncation-popover > span')
+                    if ships_from_span:
+                        shipping_from = ships_from_span.text.strip()
+                    else:
+                        shipping_from = ''
+                        print(f'{url} 获取货源地信息失败')
+            sold_by_span = _select_one(buy_box_div,
+                '#merchantInfoFeature_feature_div > div.offer-display-feature-text.a-size-small > div.offer-display-feature-text.a-spacing-none.odf-truncation-popover.aok-inline-block')
+            if sold_by_span:
+                sold_by = sold_by_span.text.strip()
+            else:
+                sold_by_span = _select_one(buy_box_div,
+                    '#merchantInfoFeature_feature_div > div.offer-display-feature-text.a-size-small > div.offer-display-feature-text.a-spacing-none.odf-truncation-popover > span')
+                if sold_by_span:
+                    sold_by = sold_by_span.text.strip()
+                else:
+                    sold_by = ''
+                    print(f'{url} 无法获取卖方信息')
+            product.shipping_from_amazon = shipping_from_amazon(shipping_from, sold_by)
+        else:
+            price_feature_div = _select_one(main_soup, '#corePrice_feature_div')
+            if price_feature_div:
+                availability = True
+                price_span = _select_one(price_feature_div, 'span.a-offscreen')
+                if price_span:
+                    product.price = extract_price(price_span.text)
+                delivery_tag = _select_one(main_soup,
+                    '#mir-layout-DELIVERY_BLOCK-slot-PRIMARY_DELIVERY_MESSAGE_LARGE > span')
+                if delivery_tag:
+                    product.shipping_cost = delivery_tag.text.strip().split(' ')[0]
+                shipping_from_span = _select_one(main_soup, '#fulfillerInfoFeature_feature_div > '
+                                                          'div.offer-display-feature-text.a-size-small > div.offer-display-feature-text.a-spacing-none.odf-truncation-popover > span')
+                if shipping_from_span:
+                    shipping_from = shipping_from_span.text.strip()
+                else:
+                    shipping_from = ''
+                sold_by_span = _select_one(main_soup, '#sellerProfileTriggerId')
+                if sold_by_span:
+                    sold_by = sold_by_span.text.strip()
+                else:
+                    sold_by = ''
+                product.shipping_from_amazon = shipping_from_amazon(shipping_from, sold_by)
+            availability = availability
+            product.completed = True
+    else:
+        availability_span = _select_one(new_product_div, '#availability > span')
+        if availability_span is None:
+            select_quantity = _select_one(new_product_div, '#selectQuantity')
+            availability = select_quantity is not None
+        else:
+            availability = 'in stock' in availability_span.text.lower()
+            availability = availability or 'available to ship' in availability_span.text.lower()
+        price_span = _select_one(new_product_div,
+            '#corePrice_feature_div > div > div > div > div > span.a-price.a-text-normal.aok-align-center.reinventPriceAccordionT2 > span.a-offscreen')
+        if price_span is None:
+            product.invalid = True
+            product.completed = True
+            return product
+        product.price = extract_price(price_span.text)
+        shipping_info = _select_one(new_product_div,
+            '#mir-layout-DELIVERY_BLOCK-slot-PRIMARY_DELIVERY_MESSAGE_MEDIUM')
+        if shipping_info is None:
+            shipping_info = _select_one(new_product_div, '#mir-layout-DELIVERY_BLOCK-slot-NO_PROMISE_UPSELL_MESSAGE')
+        if shipping_info:
+            product.shipping_cost = shipping_info.text.strip().split(' ')[0]
+        else:
+            print(f'{url} 获取运费信息失败')
+        shipping_from_span = _select_one(new_product_div,
+            '#sfsb_accordion_head > div:nth-child(1) > div > span:nth-child(2)')
+        if shipping_from_span:
+            shipping_from = shipping_from_span.text.strip()
+        else:
+            shipping_from = ''
+            print(f'{url} 获取货源地信息失败')
+        sold_by_span = _select_one(new_product_div,
+            '#sfsb_accordion_head > div:nth-child(2) > div > span:nth-child(2)')
+        if sold_by_span:
+            sold_by = sold_by_span.text.strip()
+        else:
+            sold_by = ''
+            print(f'{url} 获取卖方信息失败')
+    product.shipping_from_amazon = shipping_from_amazon(shipping_from, sold_by)
+    product.completed = True
+    product.availability = availability
+    return product
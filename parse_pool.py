@@ -0,0 +1,78 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+
+from bean import Product
+from logger import setup_concurrent_logging
+from page_parser import parse_product_html
+
+logger = setup_concurrent_logging()
+
+
+class ParsePool:
+    """
+    解析阶段的进程池：浏览器线程只负责拿 HTML，解析在子进程中进行，
+    多个标签页的解析开销分散到所有 CPU 核心上，不再受 GIL 限制。
+
+    提交队列有上限，解析跟不上时 submit 会阻塞获取阶段，避免 HTML 在内存中堆积。
+    """
+
+    def __init__(self, on_parsed: Callable[[Product], None], max_workers: int = None, max_pending: int = None):
+        """
+        :param on_parsed: 解析完成的回调，在进程池的结果线程中调用，需自行保证线程安全
+        :param max_workers: 子进程数，默认为 CPU 核数
+        :param max_pending: 已提交但未解析完成的页面数上限，默认为子进程数的 4 倍
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        self.on_parsed = on_parsed
+        self._slots = threading.BoundedSemaphore(max_pending or self.max_workers * 4)
+        self._pending = 0
+        self._lock = threading.Condition()
+
+    def submit(self, product: Product, main_page_source: str):
+        """提交一个待解析的页面，队列已满时阻塞"""
+        self._slots.acquire()
+        with self._lock:
+            self._pending += 1
+        try:
+            future = self.executor.submit(parse_product_html, product, main_page_source)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda f, p=product: self._on_done(f, p))
+
+    def _on_done(self, future, product: Product):
+        try:
+            # 子进程返回的是反序列化后的新对象
+            parsed = future.result()
+        except Exception as e:
+            logger.error(f'{product.url} 解析失败: {e}')
+            product.completed = False
+            product.last_error = 'parse_error'
+            parsed = product
+        try:
+            self.on_parsed(parsed)
+        except Exception as e:
+            logger.error(f'{product.url} 处理解析结果失败: {e}')
+        finally:
+            self._release()
+
+    def _release(self):
+        self._slots.release()
+        with self._lock:
+            self._pending -= 1
+            self._lock.notify_all()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def join(self, timeout: float = None) -> bool:
+        """等待所有已提交的页面解析完成"""
+        with self._lock:
+            return self._lock.wait_for(lambda: self._pending == 0, timeout=timeout)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
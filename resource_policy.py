@@ -0,0 +1,136 @@
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet
+from urllib.parse import urlsplit
+
+from logger import setup_concurrent_logging
+
+logger = setup_concurrent_logging()
+
+# 默认拦截的资源类型：解析只读取 page.content()，这些资源不影响 DOM
+DEFAULT_BLOCKED_TYPES = frozenset({'image', 'media', 'font'})
+
+# 内置的广告、埋点域名 (包含子域名)，启用拦截且未指定域名时使用
+DEFAULT_BLOCKED_DOMAINS = frozenset({
+    'amazon-adsystem.com',
+    'doubleclick.net',
+    'googlesyndication.com',
+    'google-analytics.com',
+    'googletagmanager.com',
+    'fls-na.amazon.com',
+    'unagi.amazon.com',
+    'unagi-na.amazon.com',
+    'facebook.net',
+    'scorecardresearch.com',
+})
+
+# 被拦截请求无法得知真实大小，按资源类型的典型大小估算节省的流量 (只是估算值，不是实测)
+ESTIMATED_BYTES = {
+    'image': 30 * 1024,
+    'media': 500 * 1024,
+    'font': 40 * 1024,
+    'stylesheet': 20 * 1024,
+    'script': 50 * 1024,
+}
+DEFAULT_ESTIMATED_BYTES = 5 * 1024
+
+
+@dataclass
+class ResourcePolicy:
+    """资源拦截策略：按资源类型和域名决定是否中止请求"""
+    blocked_types: FrozenSet[str] = DEFAULT_BLOCKED_TYPES
+    blocked_domains: FrozenSet[str] = DEFAULT_BLOCKED_DOMAINS
+
+    @classmethod
+    def from_option(cls, option: str, domains: str = None):
+        """
+        从命令行参数构建策略。
+
+        :param option: 拦截的资源类型，例如 "image,media,font"，为空或 "none" 表示不按类型拦截
+        :param domains: 拦截的域名，逗号分隔，"default" 表示内置的广告埋点域名，"none" 表示不按域名拦截；
+                        未指定时按类型拦截的同时拦截内置域名
+        :return: 类型和域名都不拦截时返回 None，表示不安装请求路由
+        """
+        types = {t.strip().lower() for t in (option or '').split(',') if t.strip()}
+        types.discard('none')
+        blocked_domains = set()
+        if domains is None or not domains.strip():
+            if types:
+                blocked_domains = set(DEFAULT_BLOCKED_DOMAINS)
+        else:
+            for domain in (d.strip().lower() for d in domains.split(',')):
+                if domain == 'default':
+                    blocked_domains.update(DEFAULT_BLOCKED_DOMAINS)
+                elif domain and domain != 'none':
+                    blocked_domains.add(domain)
+        if not types and not blocked_domains:
+            return None
+        return cls(blocked_types=frozenset(types), blocked_domains=frozenset(blocked_domains))
+
+    def should_block(self, resource_type: str, url: str) -> bool:
+        if resource_type in self.blocked_types:
+            return True
+        host = urlsplit(url).hostname or ''
+        return any(host == domain or host.endswith('.' + domain) for domain in self.blocked_domains)
+
+
+@dataclass
+class BlockStats:
+    """单个页面的拦截统计"""
+    requests: int = 0
+    bytes: int = 0
+    by_type: Dict[str, int] = field(default_factory=dict)
+
+    def record(self, resource_type: str):
+        self.requests += 1
+        self.bytes += ESTIMATED_BYTES.get(resource_type, DEFAULT_ESTIMATED_BYTES)
+        self.by_type[resource_type] = self.by_type.get(resource_type, 0) + 1
+
+
+class ResourceBlocker:
+    """
+    通过 context.route 安装资源拦截，并按标签页统计拦截的请求数和估算节省的字节数。
+    同一个 context 下的所有标签页共用一个拦截器。
+
+    注意：Playwright 启用请求路由后浏览器不再使用 HTTP 缓存，浏览器的磁盘缓存对这些 context 不起作用，
+    未拦截的脚本、样式每次都重新下载。因此拦截默认关闭，只在带宽比缓存更重要时开启。
+    """
+
+    def __init__(self, policy: ResourcePolicy):
+        self.policy = policy
+        self._stats: Dict[object, BlockStats] = {}
+
+    def _check(self, route) -> bool:
+        request = route.request
+        if not self.policy.should_block(request.resource_type, request.url):
+            return False
+        try:
+            page = request.frame.page
+        except Exception:
+            # Service Worker 等请求没有所属页面
+            page = None
+        self._stats.setdefault(page, BlockStats()).record(request.resource_type)
+        return True
+
+    def _handle(self, route):
+        if self._check(route):
+            route.abort()
+        else:
+            route.continue_()
+
+    async def _handle_async(self, route):
+        if self._check(route):
+            await route.abort()
+        else:
+            await route.continue_()
+
+    def install(self, context):
+        """在同步 API 的 context 上安装拦截"""
+        context.route("**/*", self._handle)
+
+    async def install_async(self, context):
+        """在异步 API 的 context 上安装拦截"""
+        await context.route("**/*", self._handle_async)
+
+    def pop_stats(self, page) -> BlockStats:
+        """取出并清空页面的拦截统计，在每个商品处理完后调用"""
+        return self._stats.pop(page, None) or BlockStats()
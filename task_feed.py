@@ -0,0 +1,67 @@
+import threading
+from collections import deque
+from typing import Iterable, List, Optional
+
+from bean import Product
+
+
+class TaskFeed:
+    """
+    线程安全的爬取任务源：同步商品列表的线程边下载边放入，爬取引擎边爬取边取出。
+    close 之后任务取完即结束。
+    """
+
+    def __init__(self):
+        self._items = deque()
+        self._closed = False
+        self._condition = threading.Condition()
+        # 累计放入的任务数 (不含重试放回的任务)
+        self.total = 0
+
+    def extend(self, products: Iterable[Product]):
+        with self._condition:
+            count = len(self._items)
+            self._items.extend(products)
+            self.total += len(self._items) - count
+            self._condition.notify_all()
+
+    def put(self, product: Product):
+        """放回需要重试的任务"""
+        with self._condition:
+            self._items.append(product)
+            self._condition.notify_all()
+
+    def close(self):
+        """不会再有新任务"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    @property
+    def done(self) -> bool:
+        """已关闭且任务已取完"""
+        with self._condition:
+            return self._closed and not self._items
+
+    def get(self, timeout: float = None) -> Optional[Product]:
+        """取一个任务，没有任务时最多等待 timeout 秒；超时或任务已取完时返回 None"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._items or self._closed, timeout=timeout)
+            return self._items.popleft() if self._items else None
+
+    def get_nowait(self) -> Optional[Product]:
+        with self._condition:
+            return self._items.popleft() if self._items else None
+
+    def drain(self) -> List[Product]:
+        """取出当前所有任务"""
+        with self._condition:
+            items = list(self._items)
+            self._items.clear()
+            return items
+
+    def wait_for_tasks(self, timeout: float = None) -> bool:
+        """等待第一批任务到达，返回是否有任务可爬 (列表同步结束且没有任务时返回 False)"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._items or self._closed, timeout=timeout)
+            return bool(self._items)
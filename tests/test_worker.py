@@ -0,0 +1,37 @@
+import copy
+import logging
+
+import pytest
+
+pytest.importorskip('PyQt5')
+pytest.importorskip('playwright')
+
+from bean import Product
+from worker import CrawlWorker
+
+
+def make_product(product_id, asin):
+    return Product(product_id=product_id, asin=asin, url=f'https://www.amazon.com/dp/{asin}', owner='tester')
+
+
+def test_record_result_accepts_copied_leader():
+    """解析进程返回的是代表商品的副本，也要清除代表并保存结果"""
+    worker = CrawlWorker('tester', None, logging.getLogger(__name__))
+    leader, follower = make_product('1', 'B000000001'), make_product('2', 'B000000001')
+    assert worker._dedupe_by_asin([leader, follower]) == [leader]
+
+    result = copy.deepcopy(leader)
+    result.price = 9.99
+    result.availability = True
+    result.completed = True
+    assert worker._record_result(result)
+
+    assert 'B000000001' not in worker.asin_leaders
+    assert worker.asin_results['B000000001'] is result
+    assert follower.completed and follower.price == 9.99
+
+    # 后续批次中同一 ASIN 的商品直接复用结果，不再挂到已结束的代表商品上
+    later = make_product('3', 'B000000001')
+    assert worker._dedupe_by_asin([later]) == []
+    assert later.completed and later.price == 9.99
+    assert worker.processed_num == 3
@@ -0,0 +1,152 @@
+import json
+import re
+from typing import Dict, Iterable, List
+
+import requests
+
+from bean import Product
+from constant import PRODUCT_DETAIL_PAGE, product_payload
+from extractor import AmazonASINExtractor
+from logger import setup_concurrent_logging
+from page_parser import extract_price
+
+logger = setup_concurrent_logging()
+
+# 单次请求携带的 ASIN 数
+VARIANT_BATCH_SIZE = 20
+
+_UNAVAILABLE_RE = re.compile(r'currently unavailable|out of stock|unavailable', re.IGNORECASE)
+_PRICE_RE = re.compile(r'\$\s?\d{1,3}(?:,\d{3})*(?:\.\d+)?')
+
+
+def _iter_chunks(text: str):
+    """接口返回多个以 &&& 分隔的 JSON 片段"""
+    for chunk in text.split('&&&'):
+        chunk = chunk.strip()
+        if not chunk:
+            continue
+        try:
+            yield json.loads(chunk)
+        except ValueError:
+            continue
+
+
+def _find_key(data, key):
+    """在嵌套的 dict/list 中查找第一个指定 key 的值"""
+    if isinstance(data, dict):
+        if key in data:
+            return data[key]
+        values = data.values()
+    elif isinstance(data, list):
+        values = data
+    else:
+        return None
+    for value in values:
+        found = _find_key(value, key)
+        if found is not None:
+            return found
+    return None
+
+
+def parse_variant_response(text: str) -> Dict[str, dict]:
+    """
+    解析 twisterDimensionSlotsDefault 的返回内容。
+
+    :return: {asin: {'price': float 或 None, 'availability': bool}}，只包含能确定结果的 ASIN
+    """
+    results = {}
+    for chunk in _iter_chunks(text):
+        asin = chunk.get('ASIN') if isinstance(chunk, dict) else None
+        if not asin:
+            continue
+        slot_json = _find_key(chunk, 'twisterSlotJson') or {}
+        slot_div = _find_key(chunk, 'twisterSlotDiv') or ''
+
+        price = None
+        raw_price = slot_json.get('price') if isinstance(slot_json, dict) else None
+        if raw_price not in (None, ''):
+            price = extract_price(str(raw_price)) or None
+        if price is None and isinstance(slot_div, str):
+            match = _PRICE_RE.search(slot_div)
+            if match:
+                price = extract_price(match.group()) or None
+
+        available = slot_json.get('isAvailable') if isinstance(slot_json, dict) else None
+        if available is None and isinstance(slot_div, str) and _UNAVAILABLE_RE.search(slot_div):
+            available = False
+
+        if available is False:
+            results[asin] = {'price': price, 'availability': False}
+        elif price is not None:
+            results[asin] = {'price': price, 'availability': True}
+    return results
+
+
+def fetch_variant_slots(session: requests.Session, parent_asin: str, asins: List[str]) -> Dict[str, dict]:
+    """一次请求获取同一父 ASIN 下多个变体的价格和库存"""
+    if not asins:
+        return {}
+    payload = dict(product_payload)
+    # 商品类型和分类因商品而异，不沿用固定值
+    payload.pop('productTypeDefinition', None)
+    payload.pop('productGroupId', None)
+    payload['asinList'] = ','.join(asins)
+    payload['asin'] = asins[0]
+    payload['landingAsin'] = asins[0]
+    payload['parentAsin'] = parent_asin
+    try:
+        resp = session.get(PRODUCT_DETAIL_PAGE, params=payload, timeout=10)
+    except Exception as e:
+        logger.warning(f'批量获取变体信息失败: {e}')
+        return {}
+    if resp.status_code != 200:
+        logger.warning(f'批量获取变体信息失败，状态码：{resp.status_code}')
+        return {}
+    return parse_variant_response(resp.text)
+
+
+def prefetch_variants(session: requests.Session, products: Iterable[Product], known: Dict[str, Product],
+                      batch_size: int = VARIANT_BATCH_SIZE):
+    """
+    按父 ASIN 分批请求变体接口，刷新已有完整结果的商品的价格和库存。
+
+    变体接口只返回价格和库存，发货方、运费和是否二手沿用 known 中上次完整爬取的结果；
+    没有完整结果的商品不请求接口，直接交给完整的页面加载。
+
+    :param known: {product_id: 已保存的完整结果}，见 AmazonDatabase.get_known_results
+    :return: (已解决的商品列表, 需要完整加载页面的商品列表)
+    """
+    resolved, unresolved = [], []
+    # 父 ASIN -> {ASIN: [商品]}
+    families = {}
+    for product in products:
+        result = known.get(str(product.product_id))
+        asin = product.asin or (AmazonASINExtractor.extract_asin(product.url) if product.url else None)
+        if result is None or not asin or (result.asin and result.asin.upper() != asin.upper()):
+            unresolved.append(product)
+            continue
+        product.asin = asin
+        families.setdefault(result.parent_asin, {}).setdefault(asin, []).append(product)
+
+    for parent_asin, by_asin in families.items():
+        asins = list(by_asin)
+        for i in range(0, len(asins), batch_size):
+            batch = asins[i:i + batch_size]
+            slots = fetch_variant_slots(session, parent_asin, batch)
+            for asin in batch:
+                slot = slots.get(asin)
+                for product in by_asin[asin]:
+                    if slot is None:
+                        unresolved.append(product)
+                        continue
+                    result = known[str(product.product_id)]
+                    product.parent_asin = parent_asin
+                    product.used = result.used
+                    product.shipping_from_amazon = result.shipping_from_amazon
+                    product.shipping_cost = result.shipping_cost
+                    product.price = slot['price']
+                    product.availability = slot['availability']
+                    product.invalid = False
+                    product.completed = True
+                    resolved.append(product)
+    return resolved, unresolved
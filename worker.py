@@ -1,11 +1,36 @@
+import asyncio
 import concurrent.futures
+import queue
+import threading
 import time
+from collections import deque
 
 from PyQt5.QtCore import QObject, pyqtSignal, QWaitCondition, QMutex
 from itertools import cycle # 导入循环迭代器
-from agent import AmazonAgent
+from agent import AmazonAgent, new_zip_session, storage_state_path
+from asin_cache import DEFAULT_TTL_HOURS, AsinResultCache
+from async_agent import AsyncAmazonAgent
+from http_fetch import FETCH_MODE_BROWSER
+from memory_watchdog import RECYCLE_AFTER_NAVIGATIONS, RSS_LIMIT_MB, MemoryWatchdog
+from pacing import AdaptivePacer
+from page_parser import parse_product_html
+from parse_pool import ParsePool
+from task_feed import TaskFeed
+from variant_fetch import prefetch_variants
 from bit_browser import *
+from constant import MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY
 from db_util import AmazonDatabase
+from extractor import AmazonASINExtractor
+
+# 多标签页模式下单个页面从发起导航到强制收取的最长等待时间（秒）
+PAGE_READY_TIMEOUT = 30
+# 每处理多少个商品输出一次请求速率和验证码率
+PACING_LOG_INTERVAL = 50
+
+
+def retry_delay(attempts: int) -> int:
+    """第 attempts 次失败后到下次重试的等待秒数 (指数退避)"""
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** max(0, attempts - 1))
 
 
 class CrawlWorker(QObject):
@@ -21,7 +46,24 @@ class CrawlWorker(QObject):
     def __init__(self, username, agent, logger,
                  max_workers=5,
                  batch_size=100,
-                 use_bit=False):
+                 use_bit=False,
+                 page_count=1,
+                 engine='sync',
+                 concurrency=50,
+                 fetch_mode=FETCH_MODE_BROWSER,
+                 resource_policy=None,
+                 parse_workers=0,
+                 variant_prefetch=False,
+                 pacing_rate=2.0,
+                 pacing_max_rate=5.0,
+                 refresh_budget=0,
+                 refresh_max_age=24,
+                 browser_service=None,
+                 recycle_after=RECYCLE_AFTER_NAVIGATIONS,
+                 rss_limit_mb=RSS_LIMIT_MB,
+                 cache_ttl=DEFAULT_TTL_HOURS,
+                 launch_config=None,
+                 full_sync_hours=24):
         super().__init__()
         self.username = username
         self.logger = logger
@@ -33,7 +75,58 @@ class CrawlWorker(QObject):
         self.is_stopped = False
         self.first_running = True
         self.use_bit = use_bit
-        self.agent_pool = []
+        self.page_count = page_count
+        self.engine = engine
+        self.concurrency = concurrency
+        self.fetch_mode = fetch_mode
+        self.resource_policy = resource_policy
+        # 解析进程数，0 表示在获取页面的线程中直接解析
+        self.parse_workers = parse_workers
+        self.parse_pool = None
+        # 是否先通过变体接口批量获取价格和库存
+        self.variant_prefetch = variant_prefetch
+        # 变体接口使用的带邮编的会话，以及构建时会话状态缓存的修改时间
+        self.variant_session = None
+        self.variant_state_mtime = None
+        # 每个 agent (出口 IP) 的初始/最大请求速率 (次/秒)，遇到验证码或 503 时自动降速
+        self.pacing_rate = pacing_rate
+        self.pacing_max_rate = pacing_max_rate
+        self.pacers = []
+        # 增量刷新：每次运行最多重新爬取 refresh_budget 个超过 refresh_max_age 小时未更新的已完成商品
+        self.refresh_budget = refresh_budget
+        self.refresh_max_age = refresh_max_age
+        # 应用级浏览器服务，提供时从服务租用浏览器，而不是每个账号启动自己的 Chrome
+        self.browser_service = browser_service
+        # 同一个 context 导航 recycle_after 次或浏览器内存超过 rss_limit_mb 时重建 context
+        self.recycle_after = recycle_after
+        self.rss_limit_mb = rss_limit_mb
+        # 跨账号共用的 ASIN 结果缓存有效期 (小时)，0 表示不使用缓存
+        self.cache_ttl = cache_ttl
+        self.result_cache = None
+        # 自行启动浏览器时的配置 (有无界面、使用的浏览器)，None 表示默认配置
+        self.launch_config = launch_config
+        # 商品列表平时只增量同步新商品，每隔 full_sync_hours 小时完整同步一次，0 表示每次都完整同步
+        self.full_sync_hours = full_sync_hours
+        # 本次运行的处理计数和待写库的商品
+        self.processed_num = 0
+        self.result_queue = queue.Queue()
+        self.completed_products = []
+        self.failed_products = []
+        # 本次保存的成功结果中，结果变化、未变化 (只更新检查时间) 和首次保存的商品数
+        self.change_stats = {'changed': 0, 'unchanged': 0, 'new': 0}
+        # 本次运行失败的商品数，以及其中已达到最大重试次数的商品数
+        self.failed_num = 0
+        self.exhausted_num = 0
+        # 本次运行中已放回队列重试过的商品，每个商品只重试一次
+        self.requeued_ids = set()
+        # 同一 ASIN 只爬取一次：代表商品编号 -> 共用其结果的其他商品；
+        # 列表分批到达，还需记录各 ASIN 尚未出结果的代表商品和已成功的结果
+        self.asin_followers = {}
+        self.asin_leaders = {}
+        self.asin_results = {}
+        self.dedupe_skipped = 0
+        # 本次运行各层获取成功的商品数，以及资源拦截节省的请求数/估算字节数
+        self.fetch_stats = {'http': 0, 'browser': 0, 'variant': 0, 'blocked_requests': 0, 'blocked_bytes': 0}
         # 添加暂停/恢复相关的同步对象
         self.max_workers = max_workers
         self.batch_size = batch_size
@@ -70,12 +163,14 @@ class CrawlWorker(QObject):
         self.mutex.unlock()
 
     def _initialize_agent_pool(self) -> list:
-        """初始化并发爬取的 Agent/Driver 实例池"""
+        """
+        打开比特浏览器窗口，返回各窗口的 CDP 调试地址。
+
+        Playwright 同步对象只能在创建它的线程中使用，因此这里只负责打开窗口，
+        每个窗口对应的 AmazonAgent 由 _crawl_with_pool 在各自的线程中创建。
+        """
         self.status_updated.emit(self.username, "初始化浏览器池...")
-        agent_pool = []
-        if not self.use_bit:
-            agent_pool.append(AmazonAgent())
-            return agent_pool
+        endpoints = []
 
         # 1. 获取所有可用的 BitBrowser ID
         browser_ids = get_all_browser_ids()
@@ -102,33 +197,23 @@ class CrawlWorker(QObject):
 
             for retry in range(max_retries):
                 try:
-                    # 3. 启动窗口并获取 Driver
+                    # 3. 启动窗口并获取调试地址
                     self.log_updated.emit(self.username,
                                           f"正在启动浏览器 #{i + 1}/{len(target_ids)} (ID: {browser_id[:8]}...), 尝试 {retry + 1}/{max_retries}")
-                    driver = get_bitbrowser_driver(browser_id)
-
-
-                    if not driver:
-                        continue
-
-                    # 4. 验证driver是否可用
-                    win = driver.current_window_handle  # 简单测试
-
-                    # 5. 为每个 Driver 创建一个独立的 Agent 实例
-                    temp_agent = AmazonAgent(driver=driver)
-
-                    agent_pool.append(temp_agent)
-                    connected = True
-                    break
+                    endpoint = get_bitbrowser_cdp_endpoint(browser_id)
+                    if endpoint:
+                        endpoints.append(endpoint)
+                        connected = True
+                        break
 
                 except Exception as e:
                     error_msg = f"初始化浏览器 #{i + 1} 失败 (第{retry + 1}次尝试): {str(e)}"
                     print(error_msg)
                     self.log_updated.emit(self.username, error_msg)
 
-                    # 等待后重试
-                    if retry < max_retries - 1:
-                        time.sleep(2)
+                # 等待后重试
+                if retry < max_retries - 1:
+                    time.sleep(2)
 
             if not connected:
                 failed_ids.append(browser_id)
@@ -139,43 +224,770 @@ class CrawlWorker(QObject):
             print(error_msg)
             self.log_updated.emit(self.username, error_msg)
 
-        if not agent_pool:
+        if not endpoints:
             self.error_occurred.emit(self.username, "所有浏览器窗口初始化失败，请检查浏览器是否已打开。")
 
-        self.agent_pool = agent_pool
-        return agent_pool
+        return endpoints
+
+    def _pool_worker(self, endpoint: str, feed: TaskFeed):
+        """单个比特浏览器窗口的爬取循环：从共享队列中取任务，处理完立即取下一个"""
+        try:
+            agent = AmazonAgent(page_count=1, cdp_endpoint=endpoint, fetch_mode=self.fetch_mode,
+                                resource_policy=self.resource_policy, pacer=self._new_pacer(),
+                                watchdog=self._new_watchdog(), result_cache=self.result_cache)
+        except Exception as e:
+            error_msg = f"连接浏览器窗口 {endpoint} 失败: {str(e)}"
+            print(error_msg)
+            self.log_updated.emit(self.username, error_msg)
+            self.logger.error(error_msg)
+            return
+
+        # Playwright 同步对象只能在创建它的线程中使用，agent 由本线程关闭
+        try:
+            while not self.is_stopped:
+                product = feed.get(timeout=0.5)
+                if product is None:
+                    if feed.done:
+                        break
+                    continue
+                self._crawl_task(product, agent, requeue=feed.put)
+                try:
+                    # 窗口不健康时隔离冷却，期间其他窗口继续从共享队列取任务
+                    self._maintain_context(agent, f"窗口 {endpoint}")
+                except Exception as e:
+                    error_msg = f"窗口 {endpoint} 重建 context 失败，停止使用该窗口: {e}"
+                    print(error_msg)
+                    self.log_updated.emit(self.username, error_msg)
+                    self.logger.error(error_msg)
+                    break
+        finally:
+            self._merge_fetch_stats(agent)
+            try:
+                agent.stop()
+            except Exception as e:
+                print(f"关闭窗口 {endpoint} 的 agent 出错: {e}")
+
+    def _crawl_with_pool(self, endpoints: list, feed: TaskFeed, db: AmazonDatabase):
+        """
+        多窗口并发爬取：所有窗口共享同一个任务源 (work-stealing)，慢窗口不会拖住整批任务。
+        数据库连接只在当前线程使用，各窗口线程通过结果队列把完成的商品交回来批量写库。
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(endpoints)) as executor:
+            futures = [executor.submit(self._pool_worker, endpoint, feed) for endpoint in endpoints]
+            while not all(future.done() for future in futures):
+                self._flush_results(db)
+                time.sleep(0.2)
+
+    def _crawl_task(self, product, agent: AmazonAgent, requeue=None):
+        """
+        单个商品的爬取任务：获取阶段在当前线程，解析阶段交给 _parse_stage
 
-    def _crawl_task(self, product, agent: AmazonAgent, db: AmazonDatabase):
-        """单个商品的爬取任务，由线程池调用"""
+        :param requeue: 获取失败 (验证码、超时) 时把商品放回任务队列的方法，由健康的 context 重试
+        """
         try:
             self.wait_if_paused()
             if self.is_stopped:
-                return product, False
+                return
 
-            agent.start_craw(product)
+            main_page_source = agent.fetch_craw(product)
+            if main_page_source is None:
+                if not self._requeue_failed(product, requeue):
+                    self._record_result(product)
+            else:
+                self._parse_stage(product, main_page_source)
+        except Exception as e:
+            error_msg = f"爬取商品 {product.url} 时发生错误: {str(e)}"
+            print(error_msg)
+            self.log_updated.emit(self.username, error_msg)
+            self.logger.error(error_msg)
+            product.completed = False
+            product.last_error = 'crawl_error'
+            self._record_result(product)
 
-            # 使用互斥锁保护共享变量的更新
-            self.mutex.lock()
-            try:
+    def _parse_stage(self, product, main_page_source: str):
+        """解析阶段：有进程池时提交到子进程异步解析，否则在当前线程解析"""
+        if self.parse_pool is not None:
+            self.parse_pool.submit(product, main_page_source)
+        else:
+            self._record_result(parse_product_html(product, main_page_source))
+
+    def _requeue_failed(self, product, requeue) -> bool:
+        """获取失败的商品在本次运行中放回队列重试一次，返回是否已放回"""
+        if requeue is None or product.completed:
+            return False
+        self.mutex.lock()
+        try:
+            if product.product_id in self.requeued_ids:
+                return False
+            self.requeued_ids.add(product.product_id)
+        finally:
+            self.mutex.unlock()
+        requeue(product)
+        return True
+
+    @staticmethod
+    def _needs_maintenance(agent: AmazonAgent) -> bool:
+        return agent.health.is_unhealthy() or agent.watchdog.recycle_reason() is not None
+
+    def _maintain_context(self, agent: AmazonAgent, name: str) -> bool:
+        """在没有进行中的导航时调用：不健康的 context 隔离后重建，导航次数或内存超限的 context 直接重建"""
+        if self._quarantine_if_unhealthy(agent, name):
+            return True
+        reason = agent.watchdog.recycle_reason()
+        if reason is None:
+            return False
+        msg = f"[回收] {name} {reason}，重建 context"
+        print(msg)
+        self.log_updated.emit(self.username, msg)
+        self.logger.info(msg)
+        # 会话本身没有问题，新建的 context 复用缓存的会话状态以快速恢复；比特浏览器窗口不注入缓存
+        agent.recycle_context(use_cached_state=agent.isolated_context)
+        return True
+
+    def _quarantine_if_unhealthy(self, agent: AmazonAgent, name: str) -> bool:
+        """
+        熔断：agent 的 context 不健康时隔离一段冷却时间，然后重建 context 并重新设置邮编。
+        连续熔断时冷却时间翻倍。返回是否发生了熔断。
+        """
+        if not agent.health.is_unhealthy():
+            return False
+        description = agent.health.describe()
+        cool_down = agent.health.trip()
+        msg = f"[熔断] {name} 不健康（{description}），隔离 {cool_down:.0f} 秒后重建 context"
+        print(msg)
+        self.log_updated.emit(self.username, msg)
+        self.logger.warning(msg)
+
+        while agent.health.remaining_cool_down() > 0 and not self.is_stopped:
+            time.sleep(0.5)
+        if self.is_stopped:
+            return True
+        agent.recycle_context()
+        msg = f"[熔断] {name} 已重建 context，恢复爬取"
+        print(msg)
+        self.log_updated.emit(self.username, msg)
+        self.logger.info(msg)
+        return True
+
+    def _dedupe_by_asin(self, tasks: list) -> list:
+        """
+        同一 ASIN 的商品只保留第一个去爬取：代表商品尚未出结果时挂在其后，结果出来后直接复用；
+        代表商品已经成功时直接复用其结果
+        """
+        unique_tasks = []
+        reused = []
+        self.mutex.lock()
+        try:
+            for product in tasks:
+                if product.asin is None and product.url:
+                    asin = AmazonASINExtractor.extract_asin(product.url)
+                    product.asin = asin.upper() if asin else None
+                if product.asin:
+                    result = self.asin_results.get(product.asin)
+                    if result is not None:
+                        product.copy_result(result)
+                        reused.append(product)
+                        continue
+                    leader = self.asin_leaders.get(product.asin)
+                    if leader is not None:
+                        self.asin_followers.setdefault(leader.product_id, []).append(product)
+                        continue
+                    self.asin_leaders[product.asin] = product
+                unique_tasks.append(product)
+            self.dedupe_skipped += len(tasks) - len(unique_tasks)
+        finally:
+            self.mutex.unlock()
+        for product in reused:
+            self._record_one(product)
+        return unique_tasks
+
+    def _record_result(self, product) -> bool:
+        """
+        统计单个商品的爬取结果并更新进度，返回是否成功。
+        成功的商品和失败的商品 (附带重试计划) 都放入结果队列等待写库；
+        同一 ASIN 的其他商品复用该结果
+        """
+        self.mutex.lock()
+        followers = self.asin_followers.pop(product.product_id, [])
+        # 解析进程返回的是反序列化后的副本，按商品编号判断是否是代表商品
+        leader = self.asin_leaders.get(product.asin) if product.asin else None
+        if leader is not None and leader.product_id == product.product_id:
+            del self.asin_leaders[product.asin]
+            if product.completed:
+                self.asin_results[product.asin] = product
+        self.mutex.unlock()
+        for follower in followers:
+            follower.copy_result(product)
+            self._record_one(follower)
+        return self._record_one(product)
+
+    def _record_one(self, product) -> bool:
+        # 使用互斥锁保护共享变量的更新
+        self.mutex.lock()
+        try:
+            self.processed_num += 1
+            if product.completed:
+                self.completed_num += 1
+            else:
+                product.attempts = (product.attempts or 0) + 1
+                product.last_error = product.last_error or 'unknown'
+                self.failed_num += 1
+                if product.attempts >= MAX_ATTEMPTS:
+                    self.exhausted_num += 1
+            self.result_queue.put(product)
+            # 更新进度（失败也算处理了一次，但计数器不加）
+            if self.is_running:
+                self.progress_updated.emit(self.username, '爬取中', self.get_progress())
+            if self.processed_num % PACING_LOG_INTERVAL == 0:
+                self._log_pacing()
+            return product.completed  # Success / Failed/Captcha
+        finally:
+            self.mutex.unlock()
+
+    def _flush_results(self, db: AmazonDatabase, force=False):
+        """把结果队列中的商品攒批写库，只能在持有数据库连接的线程中调用"""
+        try:
+            while True:
+                product = self.result_queue.get_nowait()
                 if product.completed:
-                    self.completed_num += 1
-                    # 更新进度
-                    if self.is_running:
-                        self.progress_updated.emit(self.username, '爬取中', self.get_progress())
-                    return product, True  # Success
+                    self.completed_products.append(product)
                 else:
-                    # 更新进度（即使失败也算处理了一次，但计数器不加）
-                    if self.is_running:
-                        self.progress_updated.emit(self.username, '爬取中', self.get_progress())
-                    return product, False  # Failed/Captcha
-            finally:
-                self.mutex.unlock()
+                    self.failed_products.append(product)
+        except queue.Empty:
+            pass
+        if self.completed_products and (force or len(self.completed_products) >= self.batch_size):
+            if self.result_cache is not None:
+                self.result_cache.put_many(self.completed_products)
+            # 结果未变化的商品只更新检查时间，减少写放大
+            counts = db.batch_save_crawl_results(self.completed_products)
+            if counts is not None:
+                for key, count in zip(('changed', 'unchanged', 'new'), counts):
+                    self.change_stats[key] += count
+            self.completed_products.clear()
+        if self.failed_products and (force or len(self.failed_products) >= self.batch_size):
+            # 失败的商品只更新重试相关的列，不覆盖已有的爬取结果
+            db.batch_schedule_retries([(product, retry_delay(product.attempts)) for product in self.failed_products])
+            self.failed_products.clear()
+
+    def _prefetch_variants(self, tasks: list, session, known: dict) -> list:
+        """
+        通过变体接口批量刷新已有完整结果的商品的价格和库存，返回仍需完整加载页面的商品
+        (没有完整结果或接口未返回结果的商品)
+
+        :param known: 已有完整结果的商品，见 AmazonDatabase.get_known_results
+        """
+        if not self.variant_prefetch or not tasks or not known:
+            return tasks
+        resolved, unresolved = prefetch_variants(session, tasks, known)
+        for product in resolved:
+            self._record_result(product)
+        self.mutex.lock()
+        self.fetch_stats['variant'] += len(resolved)
+        self.mutex.unlock()
+        self.logger.info(f"[变体接口] 批量解决 {len(resolved)} 个商品，剩余 {len(unresolved)} 个需要加载页面")
+        return unresolved
+
+    def _variant_session(self):
+        """
+        变体接口使用的会话：必须带有浏览器设置好的邮编，否则价格和库存对应的配送地址不对。
+        会话状态缓存更新 (浏览器设置好邮编) 后才重新尝试，没有可用会话时商品直接加载页面
+        """
+        if not self.variant_prefetch:
+            return None
+        if self.variant_session is None:
+            try:
+                mtime = storage_state_path().stat().st_mtime
+            except OSError:
+                return None
+            if mtime != self.variant_state_mtime:
+                self.variant_state_mtime = mtime
+                self.variant_session = new_zip_session()
+        return self.variant_session
+
+    def _feed_tasks(self, products: list, feed: TaskFeed, db: AmazonDatabase):
+        """按 ASIN 去重、通过变体接口批量解决后，把仍需加载页面的商品放入任务源"""
+        tasks = self._dedupe_by_asin(products)
+        session = self._variant_session()
+        if session is not None and tasks:
+            # 列表同步线程有自己的数据库连接，在这里查出已有完整结果的商品
+            known = db.get_known_results([product.product_id for product in tasks])
+            tasks = self._prefetch_variants(tasks, session, known)
+        feed.extend(tasks)
+
+    def _sync_pages(self, pages, db: AmazonDatabase, feed: TaskFeed, state: dict, stop_when_known=False):
+        """
+        逐页处理同步到的商品列表：新商品立即写库，其中待爬取的商品放入 feed。
+        state 记录已放入 feed 的商品编号、见到的商品数、新商品数、失败的页和列表中最新的商品。
+
+        :param stop_when_known: 增量同步时遇到整页都是已保存的商品即停止
+        """
+        for page_no, products, total_pages, total_items in pages:
+            self.wait_if_paused()
+            if self.is_stopped:
+                break
+            if products is None:
+                state['failed_pages'].append(page_no)
+                continue
+            if not self.total_num:
+                self.total_num = total_items
+                self.status_updated.emit(self.username, f"共获取{total_items}个链接")
+                print(f'商品总数:{total_items}，共 {total_pages} 页')
+                if self.get_progress() > 0 and self.is_running:
+                    self.progress_updated.emit(self.username, '爬取中', self.get_progress())
+            if page_no == 1 and products:
+                state['watermark'] = str(products[0].product_id)
+            # 商品编号写入临时表，新商品由 SQLite 反连接得出并在同一事务中插入
+            new_products = db.sync_listing_page(products)
+            state['new_num'] += len(new_products)
+            state['seen_num'] += len(products)
+            page_ids = [str(p.product_id) for p in products]
+            due = [p for p in db.get_product_uncompleted(self.username, product_ids=page_ids)
+                   if p.product_id not in state['fed_ids']]
+            state['fed_ids'].update(p.product_id for p in due)
+            self._feed_tasks(due, feed, db)
+            if stop_when_known and products and not new_products:
+                break
+
+    def _full_sync_due(self, full_sync_age) -> bool:
+        """是否需要完整同步：关闭了增量同步、从未完整同步过或距上次完整同步已超过 full_sync_hours 小时"""
+        return self.full_sync_hours <= 0 or full_sync_age is None or full_sync_age >= self.full_sync_hours
+
+    def _sync_listing(self, feed: TaskFeed):
+        """
+        流式同步商品列表，在独立线程中运行并使用自己的数据库连接：
+        每获取一页就写库，并把其中待爬取的商品立即放入 feed，爬取引擎不必等待整个列表下载完成。
+
+        平时只增量同步水位之前的新商品，每隔 full_sync_hours 小时完整同步一次以清理下架的商品；
+        增量同步后商品数对不上 (有商品下架或排序变化) 时立即补做完整同步。
+        """
+        db = AmazonDatabase()
+        db.connect()
+        try:
+            # 为同步 ASIN 之前保存的商品补充 ASIN
+            backfilled = db.backfill_product_asins(self.username)
+            if backfilled:
+                print(f'补充了{backfilled}个商品的 ASIN')
+            print(f'已保存产品数:{db.count_products(self.username)}')
+            state = {'fed_ids': set(), 'failed_pages': [], 'seen_num': 0, 'new_num': 0, 'watermark': None}
+            watermark, full_sync_age = db.get_listing_sync(self.username)
+            full = self._full_sync_due(full_sync_age)
+
+            if not full:
+                db.begin_listing_diff()
+                self._sync_pages(self.agent.iter_listing_pages_delta(watermark), db, feed, state,
+                                 stop_when_known=True)
+                if self.is_stopped:
+                    return
+                saved_num = db.count_products(self.username)
+                if not state['failed_pages'] and self.total_num and saved_num == self.total_num:
+                    msg = f"[同步] 增量同步 {state['seen_num']} 个商品，新增 {state['new_num']} 个"
+                    print(msg)
+                    self.log_updated.emit(self.username, msg)
+                    # 水位之后的页面没有重新获取，其中未完成的商品直接从数据库补充
+                    rest = [p for p in db.get_product_uncompleted(self.username) if p.product_id not in state['fed_ids']]
+                    state['fed_ids'].update(p.product_id for p in rest)
+                    self._feed_tasks(rest, feed, db)
+                    db.save_listing_sync(self.username, state['watermark'], full=False)
+                else:
+                    msg = f"[同步] 增量同步后商品数不一致（已保存 {saved_num} 个，列表共 {self.total_num} 个），执行完整同步"
+                    print(msg)
+                    self.log_updated.emit(self.username, msg)
+                    state['failed_pages'] = []
+                    full = True
+
+            if full:
+                db.begin_listing_diff()
+                self._sync_pages(self.agent.iter_listing_pages(), db, feed, state)
+            if state['new_num']:
+                print(f'新增加{state["new_num"]} 个商品')
+            if self.is_stopped or not self.total_num:
+                return
+
+            if full and state['failed_pages']:
+                # 列表不完整时无法判断哪些商品已经下架，本次不删除任何商品
+                msg = f"[同步] 第 {sorted(state['failed_pages'])} 页获取失败，本次不清理失效商品"
+                print(msg)
+                self.log_updated.emit(self.username, msg)
+                self.logger.warning(msg)
+            elif full:
+                # 本次列表中没有出现的商品已经下架，由 SQLite 反连接找出并在一个事务中删除
+                deleted, deleted_completed = db.delete_unseen_products(self.username)
+                if deleted:
+                    print(f'{deleted}个商品已经失效')
+                    self.log_updated.emit(self.username, f"[开始] {self.username} 删除 {deleted} 个失效商品")
+                    self.mutex.lock()
+                    self.completed_num -= deleted_completed
+                    self.mutex.unlock()
+                db.save_listing_sync(self.username, state['watermark'], full=True)
+
+            if self.refresh_budget > 0:
+                # 增量刷新：未完成的商品优先，剩余时间按最久未更新的顺序刷新已完成的商品
+                stale_products = db.get_product_stale(self.username, self.refresh_max_age, self.refresh_budget)
+                if stale_products:
+                    msg = f"[刷新] 选取 {len(stale_products)} 个超过 {self.refresh_max_age} 小时未更新的商品重新爬取"
+                    print(msg)
+                    self.log_updated.emit(self.username, msg)
+                    # 待刷新的商品重新计入进度
+                    self.mutex.lock()
+                    self.completed_num -= len(stale_products)
+                    self.mutex.unlock()
+                    self._feed_tasks(stale_products, feed, db)
         except Exception as e:
-            error_msg = f"爬取商品 {product.url} 时发生错误: {str(e)}"
+            error_msg = f"同步商品列表失败: {e}"
             print(error_msg)
             self.log_updated.emit(self.username, error_msg)
             self.logger.error(error_msg)
-            return product, False
+        finally:
+            feed.close()
+            db.close()
+
+    def _open_result_cache(self):
+        """每次运行新建 ASIN 结果缓存 (统计从零开始)，并清理过期的缓存"""
+        if self.cache_ttl <= 0:
+            return None
+        result_cache = AsinResultCache(ttl_hours=self.cache_ttl)
+        evicted = result_cache.evict_expired()
+        if evicted:
+            self.logger.info(f"清理了 {evicted} 条过期的 ASIN 缓存")
+        return result_cache
+
+    def _close_result_cache(self):
+        """关闭本次运行的 ASIN 结果缓存在各线程打开的数据库连接"""
+        if self.result_cache is not None:
+            self.result_cache.close()
+            self.result_cache = None
+
+    def _new_watchdog(self) -> MemoryWatchdog:
+        return MemoryWatchdog(max_navigations=self.recycle_after, rss_limit_mb=self.rss_limit_mb)
+
+    def _new_pacer(self) -> AdaptivePacer:
+        """为一个 agent 创建请求节奏控制，并登记以便输出统计"""
+        pacer = AdaptivePacer(rate=self.pacing_rate, max_rate=self.pacing_max_rate)
+        self.pacers.append(pacer)
+        return pacer
+
+    def _pacing_summary(self) -> str:
+        return '；'.join(f"窗口{i + 1} {pacer.describe()}" for i, pacer in enumerate(list(self.pacers)))
+
+    def _log_pacing(self):
+        if not self.pacers:
+            return
+        msg = f"[节奏] {self._pacing_summary()}"
+        print(msg)
+        self.log_updated.emit(self.username, msg)
+        self.logger.info(msg)
+
+    def _merge_fetch_stats(self, agent):
+        """汇总各 agent 的分层获取统计"""
+        self.mutex.lock()
+        for tier, count in agent.fetch_stats.items():
+            self.fetch_stats[tier] = self.fetch_stats.get(tier, 0) + count
+        self.mutex.unlock()
+
+    def _crawl_sequential(self, agent: AmazonAgent, feed: TaskFeed, db: AmazonDatabase):
+        """单标签页逐个爬取"""
+        while not self.is_stopped:
+            product = feed.get(timeout=0.5)
+            if product is None:
+                if feed.done:
+                    break
+                # 等待列表同步送来新任务，期间把已有结果写库
+                self._flush_results(db)
+                continue
+            self._crawl_task(product, agent, requeue=feed.put)
+            if self.is_stopped:
+                break
+            self._flush_results(db)
+            try:
+                self._maintain_context(agent, "浏览器")
+            except Exception as e:
+                # 未爬取的商品仍是未完成状态，下次运行时继续
+                error_msg = f"浏览器重建 context 失败，停止爬取: {e}"
+                print(error_msg)
+                self.log_updated.emit(self.username, error_msg)
+                self.logger.error(error_msg)
+                break
+
+    def _crawl_with_pages(self, agent: AmazonAgent, feed: TaskFeed, db: AmazonDatabase):
+        """
+        多标签页调度：同一线程内轮流驱动 agent.pages 中的所有标签页，
+        导航只等待 commit，页面加载在浏览器内并行进行，保证每个标签页都不空闲。
+        """
+        pending = deque()
+        in_flight = {}  # 标签页序号 -> (product, 发起时间)
+
+        while pending or in_flight or not feed.done:
+            # 取出列表同步期间新到达的任务
+            pending.extend(feed.drain())
+            self.wait_if_paused()
+            if self.is_stopped:
+                break
+
+            # 0. context 不健康或需要回收时停止分派，等进行中的标签页收取完毕后重建，待爬商品留在队列中
+            needs_maintenance = self._needs_maintenance(agent)
+            if needs_maintenance and not in_flight:
+                try:
+                    self._maintain_context(agent, "浏览器")
+                except Exception as e:
+                    # 未爬取的商品仍是未完成状态，下次运行时继续
+                    error_msg = f"浏览器重建 context 失败，停止爬取: {e}"
+                    print(error_msg)
+                    self.log_updated.emit(self.username, error_msg)
+                    self.logger.error(error_msg)
+                    break
+                continue
+
+            # 1. 给空闲标签页分派新任务，没有令牌时等下一轮，不阻塞已在加载的标签页
+            progressed = False
+            for index, page in enumerate(agent.pages):
+                if index in in_flight:
+                    continue
+                # 命中 ASIN 结果缓存的商品不占用标签页和令牌
+                while pending and agent.serve_from_cache(pending[0]):
+                    self._record_result(pending.popleft())
+                    progressed = True
+                if not pending:
+                    continue
+                if needs_maintenance or not agent.pacer.try_acquire():
+                    break
+                progressed = True
+                product = pending.popleft()
+                try:
+                    navigating, main_page_source = agent.begin_craw(product, page, wait_until="commit")
+                except Exception as e:
+                    self.logger.error(f"爬取商品 {product.url} 时发生错误: {e}")
+                    product.last_error = 'crawl_error'
+                    navigating, main_page_source = False, None
+                if navigating:
+                    in_flight[index] = (product, time.time())
+                elif main_page_source is not None:
+                    self._parse_stage(product, main_page_source)
+                else:
+                    self._record_result(product)
+
+            # 2. 收取已就绪（或等待超时）的标签页
+            for index, (product, started_at) in list(in_flight.items()):
+                page = agent.pages[index]
+                if not agent.is_page_ready(page) and time.time() - started_at < PAGE_READY_TIMEOUT:
+                    continue
+                del in_flight[index]
+                progressed = True
+                try:
+                    # 已就绪的页面状态可立即判定，超时的页面只再给一次短暂等待
+                    main_page_source = agent.finish_fetch(product, page, timeout=1000)
+                    if main_page_source is None:
+                        if not self._requeue_failed(product, pending.append):
+                            self._record_result(product)
+                    else:
+                        self._parse_stage(product, main_page_source)
+                except Exception as e:
+                    error_msg = f"爬取商品 {product.url} 时发生错误: {str(e)}"
+                    print(error_msg)
+                    self.log_updated.emit(self.username, error_msg)
+                    self.logger.error(error_msg)
+                    # 与发起导航失败一样记为一次失败，不能丢掉该商品
+                    product.completed = False
+                    product.last_error = 'crawl_error'
+                    self._record_result(product)
+
+            self._flush_results(db)
+            if not progressed:
+                # 让出事件循环，等待浏览器继续加载或令牌恢复
+                agent.page.wait_for_timeout(100)
+
+    def _crawl_async(self, feed: TaskFeed, db: AmazonDatabase):
+        """
+        使用异步引擎爬取。
+        事件循环运行在单独的线程中，不做任何阻塞的数据库操作；
+        数据库连接只在当前线程使用，结果队列中的商品由当前线程批量写库
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(asyncio.run, self._crawl_async_main(feed))
+            while not future.done():
+                self._flush_results(db)
+                time.sleep(0.2)
+            future.result()
+
+    async def _async_wait_if_paused(self):
+        """wait_if_paused 的协程版本，暂停期间不阻塞事件循环"""
+        while self.is_paused and not self.is_stopped:
+            await asyncio.sleep(0.5)
+
+    async def _crawl_async_main(self, feed: TaskFeed):
+        parse_executor = self.parse_pool.executor if self.parse_pool is not None else None
+        endpoint = await asyncio.to_thread(self.browser_service.lease) if self.browser_service else None
+        agent = AsyncAmazonAgent(concurrency=self.concurrency, fetch_mode=self.fetch_mode,
+                                 resource_policy=self.resource_policy, parse_executor=parse_executor,
+                                 pacer=self._new_pacer(), cdp_endpoint=endpoint, watchdog=self._new_watchdog(),
+                                 result_cache=self.result_cache, launch_config=self.launch_config)
+        try:
+            await agent.start()
+        except Exception:
+            await agent.stop()
+            if endpoint:
+                self.browser_service.release(endpoint)
+            raise
+
+        async def consume():
+            while not self.is_stopped:
+                await self._async_wait_if_paused()
+                if self.is_stopped:
+                    return
+                product = feed.get_nowait()
+                if product is None:
+                    if feed.done:
+                        return
+                    # 等待列表同步送来新任务
+                    await asyncio.sleep(0.2)
+                    continue
+                try:
+                    product = await agent.start_craw(product)
+                except Exception as e:
+                    error_msg = f"爬取商品 {product.url} 时发生错误: {str(e)}"
+                    print(error_msg)
+                    self.log_updated.emit(self.username, error_msg)
+                    self.logger.error(error_msg)
+                    # 记为一次失败，不能丢掉该商品
+                    product.completed = False
+                    product.last_error = 'crawl_error'
+                    self._record_result(product)
+                    continue
+                if self._requeue_failed(product, feed.put):
+                    continue
+                self._record_result(product)
+
+        try:
+            await asyncio.gather(*(consume() for _ in range(agent.concurrency)))
+        finally:
+            self._merge_fetch_stats(agent)
+            await agent.stop()
+            if endpoint:
+                self.browser_service.release(endpoint)
+
+    def _crawl_with_agent(self, feed: TaskFeed, db: AmazonDatabase) -> int:
+        """同步引擎：单个 agent 逐个或多标签页爬取，返回使用的标签页数"""
+        endpoint = self.browser_service.lease() if self.browser_service else None
+        try:
+            agent = AmazonAgent(page_count=self.page_count, fetch_mode=self.fetch_mode,
+                                resource_policy=self.resource_policy, pacer=self._new_pacer(),
+                                cdp_endpoint=endpoint, isolated_context=True, watchdog=self._new_watchdog(),
+                                result_cache=self.result_cache, launch_config=self.launch_config)
+        except Exception:
+            if endpoint:
+                self.browser_service.release(endpoint)
+            raise
+        try:
+            page_num = len(agent.pages)
+            if page_num > 1:
+                self._crawl_with_pages(agent, feed, db)
+            else:
+                self._crawl_sequential(agent, feed, db)
+            return page_num
+        finally:
+            self._merge_fetch_stats(agent)
+            agent.stop()
+            if endpoint:
+                self.browser_service.release(endpoint)
+
+    def _reset_run_state(self):
+        """每次运行开始前重置计数和结果缓冲，需在列表同步线程启动前调用"""
+        self.processed_num = 0
+        self.result_queue = queue.Queue()
+        self.completed_products = []
+        self.failed_products = []
+        self.change_stats = {'changed': 0, 'unchanged': 0, 'new': 0}
+        self.failed_num = 0
+        self.exhausted_num = 0
+        self.requeued_ids = set()
+        self.asin_followers = {}
+        self.asin_leaders = {}
+        self.asin_results = {}
+        self.dedupe_skipped = 0
+        # 统计只针对本次运行，暂停/停止后再次运行时重新计数
+        self.fetch_stats = {'http': 0, 'browser': 0, 'variant': 0, 'blocked_requests': 0, 'blocked_bytes': 0}
+        self.variant_session = None
+        self.variant_state_mtime = None
+        self.pacers = []
+        self._close_result_cache()
+        self.result_cache = self._open_result_cache()
+
+    def _crawl_products(self, feed: TaskFeed, db: AmazonDatabase):
+        """按配置选择引擎爬取 feed 中的任务，并输出本次的吞吐量统计"""
+        start_time = time.time()
+        # 第一批任务到达后再启动浏览器，列表中没有需要加载页面的商品时不启动
+        has_tasks = False
+        while not self.is_stopped:
+            if feed.wait_for_tasks(timeout=0.5):
+                has_tasks = True
+                break
+            self._flush_results(db)
+            if feed.done:
+                break
+        engine = self.engine
+        page_num = 0
+        try:
+            if has_tasks:
+                if self.parse_workers > 0:
+                    # 解析结果由进程池的结果线程直接记录，写库仍在当前线程
+                    self.parse_pool = ParsePool(on_parsed=self._record_result, max_workers=self.parse_workers)
+                endpoints = self._initialize_agent_pool() if self.use_bit else []
+                if self.use_bit and not endpoints:
+                    return
+                if endpoints:
+                    self._crawl_with_pool(endpoints, feed, db)
+                    page_num = len(endpoints)
+                    engine = 'bitbrowser'
+                elif self.engine == 'async':
+                    self._crawl_async(feed, db)
+                    page_num = self.concurrency
+                else:
+                    page_num = self._crawl_with_agent(feed, db)
+        finally:
+            if self.parse_pool is not None:
+                # 等待进程池中剩余的页面解析完成
+                self.parse_pool.join()
+                self.parse_pool.shutdown()
+                self.parse_pool = None
+            # 处理剩余的成功商品
+            self._flush_results(db, force=True)
+
+        # 输出吞吐量，便于对比不同引擎与并发数下的速度
+        elapsed = time.time() - start_time
+        processed = self.processed_num
+        if processed and elapsed > 0:
+            throughput = f"[统计] 引擎 {engine}，并发页面数 {page_num}，解析进程数 {self.parse_workers}，" \
+                         f"处理 {processed} 个商品，耗时 {elapsed:.1f}s，" \
+                         f"速度 {processed * 60 / elapsed:.1f} 个/分钟，" \
+                         f"变体接口 {self.fetch_stats['variant']} 个，HTTP 直取 {self.fetch_stats['http']} 个，" \
+                         f"浏览器加载 {self.fetch_stats['browser']} 个，" \
+                         f"拦截 {self.fetch_stats['blocked_requests']} 个请求" \
+                         f"（按资源类型典型大小估算节省 {self.fetch_stats['blocked_bytes'] / 1024 / 1024:.1f} MB），" \
+                         f"{self._pacing_summary()}"
+            print(throughput)
+            self.log_updated.emit(self.username, throughput)
+            self.logger.info(throughput)
+        if self.dedupe_skipped:
+            msg = f"[去重] 同一 ASIN 的商品共用结果，跳过 {self.dedupe_skipped} 次重复加载"
+            print(msg)
+            self.log_updated.emit(self.username, msg)
+            self.logger.info(msg)
+        if self.result_cache is not None and (self.result_cache.hits or self.result_cache.misses):
+            msg = f"[缓存] {self.result_cache.describe()}"
+            print(msg)
+            self.log_updated.emit(self.username, msg)
+            self.logger.info(msg)
+        if any(self.change_stats.values()):
+            msg = f"[变化] 结果变化 {self.change_stats['changed']} 个，未变化 {self.change_stats['unchanged']} 个，" \
+                  f"首次保存 {self.change_stats['new']} 个"
+            print(msg)
+            self.log_updated.emit(self.username, msg)
+            self.logger.info(msg)
+        if self.failed_num:
+            msg = f"[重试] 本次失败 {self.failed_num} 个商品，已按指数退避安排重试，" \
+                  f"其中 {self.exhausted_num} 个已达到最大重试次数 {MAX_ATTEMPTS}，不再重试"
+            print(msg)
+            self.log_updated.emit(self.username, msg)
+            self.logger.info(msg)
 
     def run(self):
         """执行爬取任务"""
@@ -196,59 +1008,31 @@ class CrawlWorker(QObject):
         if not self.is_running:
             return
 
-        all_saved_products = db.get_all_products(self.username)
-        print(f'已保存产品数:{len(all_saved_products)}')
-        ids = set([p.product_id for p in all_saved_products])
-        expired_product_ids, new_products, total_items = self.agent.parse_product_list(ids=ids)
-
-        if expired_product_ids:
-            print(f'{len(expired_product_ids)}个商品已经失效')
-            self.log_updated.emit(self.username, f"[开始] {self.username} 删除失效商品")
-            db.batch_delete_products_by_ids(expired_product_ids)
-
-        self.status_updated.emit(self.username, f"共获取{total_items}个链接")
-        if total_items <= 0:
-            self.status_updated.emit(self.username, "无法获取产品链接")
-            return
-
-        # 检查是否被暂停
-        self.wait_if_paused()
-        if self.is_stopped:
-            return
+        self._reset_run_state()
+        self.total_num = 0
+        # 进度从已完成的商品数开始计算，列表同步中删除失效商品、选取待刷新商品时再做调整
+        self.completed_num = db.count_product_completed(self.username)
+        waiting_num, exhausted_num = db.count_product_deferred(self.username)
+        if waiting_num or exhausted_num:
+            msg = f"[重试] {waiting_num} 个商品未到重试时间，{exhausted_num} 个商品已达到最大重试次数，本次跳过"
+            print(msg)
+            self.log_updated.emit(self.username, msg)
 
-        if new_products:
-            print(f'新增加{len(new_products)} 个商品')
-            db.batch_upsert_products_chunked(new_products)
+        # 列表同步在独立线程中进行，第一页到达后即开始爬取，其余页面边下载边加入任务源
+        feed = TaskFeed()
+        listing_thread = threading.Thread(target=self._sync_listing, args=(feed,), daemon=True)
+        listing_thread.start()
 
+        # 3. 单标签页逐个爬取、多标签页/多窗口并发爬取或异步引擎爬取
         self.log_updated.emit(self.username, f"[开始] {self.username} 开始执行爬取任务")
-        self.total_num = total_items
-        print(f'商品总数:{total_items}')
-
-        product_uncompleted = db.get_product_uncompleted(self.username)
-        print(f'未解析完成的商品数:{len(product_uncompleted)}')
-        self.completed_num = self.total_num - len(product_uncompleted)
-
-        if self.get_progress() > 0 and self.is_running:
-            self.progress_updated.emit(self.username, '爬取中', self.get_progress())
-
-        tasks = list(product_uncompleted)
-        completed_products = []
-        # 3. 使用线程池进行并发爬取
         self.status_updated.emit(self.username, "开始爬取商品")
-
-        agent = AmazonAgent()
-        for product in tasks:
-            product, success = self._crawl_task(product, agent, db)
-            if success:
-                completed_products.append(product)
-                # 批量保存已完成的商品
-                if len(completed_products) >= self.batch_size:
-                    db.batch_upsert_products_chunked(completed_products)
-                    completed_products.clear()
-                    time.sleep(0.1)
-        # 4. 处理剩余的成功商品
-        if completed_products:
-            db.batch_upsert_products_chunked(completed_products)
+        self._crawl_products(feed, db)
+        listing_thread.join()
+        self._close_result_cache()
+        print(f'本次共 {feed.total} 个商品需要加载页面')
+        if self.total_num <= 0:
+            self.status_updated.emit(self.username, "无法获取产品链接")
+            return
 
         # 5. 关闭所有 Agent/Driver
         self.log_updated.emit(self.username, "爬取结束，正在关闭浏览器窗口...")
@@ -268,19 +1052,8 @@ class CrawlWorker(QObject):
         if hasattr(self, 'total_num'):
             self.progress_updated.emit(self.username, '已停止', 0)
 
-        # 唤醒所有等待的线程
+        # 唤醒所有等待的线程；各爬取线程看到停止标志后自行关闭自己的 agent
         self.condition.wakeAll()
         self.mutex.unlock()
 
-        # 关闭所有并发Agent
-        for agent in self.agent_pool:
-            try:
-                agent.stop()
-            except Exception as e:
-                print(f"关闭agent pool出错: {e}")
-                # 继续清理其他agent，不因单个失败而停止
-
-        # 清空agent pool
-        self.agent_pool.clear()
-
         print(f"Worker {self.username} 已完全停止")